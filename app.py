@@ -1,20 +1,109 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from datetime import datetime
-import asyncio, json
-import paho.mqtt.client as mqtt
+import asyncio, json, logging, math, time
 from fastapi.middleware.cors import CORSMiddleware
-import openrouteservice
-from models import Trip, LocationLog
-from trip_routes import router as trip_router
-from models import Truck, Driver, LocationLog
-from database import SessionLocal
-from websocket_utils import active_websockets, broadcast_location_sync 
-ORS = openrouteservice.Client(key="5b3ce3597851110001cf6248e1d8e314ca754bc68acfb5b1aaa27ca5")
+from starlette.routing import Match
+from app.models import Trip, LocationLog
+from app.trip_routes import router as trip_router
+from app.models import Truck, Driver, LocationLog
+from app.database import SessionLocal, engine
+from app.websocket_utils import event_listeners, active_websockets, binary_websockets, broadcast_location_sync, register_client, unregister_client, binary_flush_loop, location_message
+from app.trip_replay import router as replay_router
+from app import metrics, rate_limit, response_cache, rollups, route_monitor
+from app.logging_setup import setup_logging, stop_logging
+setup_logging()
+logger = logging.getLogger("fleet.app")
+metrics.install_query_counter(engine)
 
 app = FastAPI()
 
 app.include_router(trip_router)
+app.include_router(replay_router)
+event_listeners.append(response_cache.invalidate_for_event)
+event_listeners.append(route_monitor.on_event)
 
+def _client_host(scope):
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _too_many_requests(retry_after):
+    return JSONResponse(
+        {"detail": "Too many requests"}, status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+@app.middleware("http")
+async def cache_responses(request: Request, call_next):
+    # Runs inside admission_control, which has already resolved the route.
+    route = request.scope.get("route")
+    if request.method != "GET" or route is None or route.path not in response_cache.CACHED_ROUTES:
+        return await call_next(request)
+
+    key = request.url.path + ("?" + request.url.query if request.url.query else "")
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        tags = response_cache.CACHED_ROUTES[route.path](route.matches(request.scope)[1]["path_params"])
+        entry = response_cache.put(key, body, response.media_type or response.headers.get("content-type"), tags, generation)
+        result = "miss"
+    else:
+        result = "hit"
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if response_cache.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        metrics.RESPONSE_CACHE.inc(route=route.path, result="not_modified")
+        return Response(status_code=304, headers=headers)
+    metrics.RESPONSE_CACHE.inc(route=route.path, result=result)
+    return Response(entry.body, media_type=entry.media_type, headers=headers)
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Limits are keyed on the route template so /truck/stats/A and
+    # /truck/stats/B share one budget. Setting scope["route"] here also
+    # labels rejected requests correctly in record_request_metrics.
+    route = next((r for r in app.router.routes if r.matches(request.scope)[0] == Match.FULL), None)
+    if route is None:
+        return await call_next(request)
+    request.scope["route"] = route
+
+    retry_after = rate_limit.check_route(_client_host(request.scope), route.path)
+    if retry_after:
+        return _too_many_requests(retry_after)
+
+    limit = rate_limit.concurrency_limit(route.path)
+    if limit is None:
+        return await call_next(request)
+    if not limit.try_acquire():
+        metrics.RATE_LIMITED.inc(scope="concurrency", route=route.path)
+        return _too_many_requests(1)
+    try:
+        return await call_next(request)
+    finally:
+        limit.release()
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    with metrics.count_queries() as queries:
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            path = route.path if route else "unmatched"
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=request.method, route=path, status=status
+            )
+            metrics.HTTP_REQUEST_DB_QUERIES.observe(queries[0], route=path)
+
+# Added after the other middleware so it is outermost and 429s carry CORS headers too.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -23,17 +112,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.websocket("/ws/location")
 async def location_ws(websocket: WebSocket):
+    encoding = websocket.query_params.get("encoding", "json")
+    since = websocket.query_params.get("since")
+    if since is not None:
+        # <epoch>:<seq>; a bare or foreign epoch just gets a fresh snapshot.
+        epoch, _, seq = since.rpartition(":")
+        since = (epoch, int(seq)) if seq.isdigit() else None
+    if encoding not in ("json", "binary") or (since is None and "since" in websocket.query_params):
+        await websocket.close(code=1003)
+        return
+    if not rate_limit.allow_websocket(_client_host(websocket.scope), "/ws/location"):
+        await websocket.close(code=1013)
+        return
+
     await websocket.accept()
-    active_websockets.add(websocket)
-    print(f"✅ WebSocket connected. Count: {len(active_websockets)}")
+    await register_client(websocket, binary=encoding == "binary", since=since)
+    logger.info("websocket connected", extra={"encoding": encoding, "clients": len(active_websockets) + len(binary_websockets)})
     try:
         while True:
             await websocket.receive_text()
-    except WebSocketDisconnect:
-        active_websockets.remove(websocket)
-        print(f"❌ WebSocket disconnected. Remaining: {len(active_websockets)}")
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the feed already closed the socket after dropping the client.
+        pass
+    finally:
+        unregister_client(websocket)
+        logger.info("websocket disconnected", extra={"encoding": encoding, "clients": len(active_websockets) + len(binary_websockets)})
 
 # MQTT Setup
 MQTT_BROKER = "broker.mqttdashboard.com"
@@ -42,100 +151,157 @@ MQTT_TOPIC = "owntracks/lincolnrao/lincolnord"
 
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print("Connected to MQTT Broker")
         client.subscribe(MQTT_TOPIC)
-        print(f"Subscribed to topic: {MQTT_TOPIC}")
+        logger.info("connected to MQTT broker", extra={"broker": MQTT_BROKER, "topic": MQTT_TOPIC})
     else:
-        print(f"Failed to connect, return code {rc}")
+        logger.error("failed to connect to MQTT broker", extra={"broker": MQTT_BROKER, "rc": rc})
 
 def on_message(client, userdata, msg):
-    print(f"\nMessage received on topic {msg.topic}")
-    db = None
+    received_at = time.perf_counter()
     try:
         payload = json.loads(msg.payload.decode())
-        print("MQTT data received:", payload)
+        logger.debug("MQTT message received", extra={"topic": msg.topic, "payload": payload})
 
         if payload.get("_type") != "location":
-            print("⚠️ Skipping non-location message:", payload)
+            metrics.INGEST_MESSAGES.inc(result="skipped")
+            logger.debug("skipping non-location message", extra={"topic": msg.topic})
             return
 
-        lat = payload.get("lat")
-        lon = payload.get("lon")
-        timestamp = payload.get("tst")
-        device = payload.get("tid", "unknown")
-
-        if lat and lon and timestamp:
-            dt = datetime.fromtimestamp(timestamp)
-            print(f"Device: {device}, Lat: {lat}, Lon: {lon}, Time: {dt}")
-
-            db = SessionLocal()
-
-            truck = db.query(Truck).filter_by(vin=device).first()
-            if not truck:
-                dummy_driver = Driver(name="OwnTracks", license_number="OWN123", contact="0000000000")
-                db.add(dummy_driver)
-                db.commit()
-                db.refresh(dummy_driver)
-
-                truck = Truck(vin=device, driver_id=dummy_driver.driver_id)
-                db.add(truck)
-                db.commit()
-                print(f"🚚 Registered new truck: {device}")
-
-            active_trip = db.query(Trip).filter_by(vin=device, status="active").first()
-            active_trip_id = active_trip.trip_id if active_trip else None
-
-            log = LocationLog(
-                vin=device,
-                trip_id=active_trip_id,
-                timestamp=dt,
-                latitude=lat,
-                longitude=lon,
-                speed=payload.get("vel", 0.0)
-            )
-            db.add(log)
+        if payload.get("lat") and payload.get("lon") and payload.get("tst"):
+            # Fixes closer together than 1/INGEST_FIXES_PER_SECOND in device
+            # time are thinned out; see rate_limit.Downsampler.
+            if not ingest_downsampler.submit(payload.get("tid", "unknown"), (payload, received_at), float(payload["tst"])):
+                metrics.INGEST_MESSAGES.inc(result="downsampled")
+        else:
+            metrics.INGEST_MESSAGES.inc(result="incomplete")
+            logger.warning("incomplete location payload", extra={"topic": msg.topic, "payload": payload})
+
+    except json.JSONDecodeError:
+        metrics.INGEST_MESSAGES.inc(result="invalid")
+        logger.warning("failed to decode MQTT payload", extra={"topic": msg.topic})
+    except Exception:
+        metrics.INGEST_MESSAGES.inc(result="error")
+        logger.exception("MQTT handler error", extra={"topic": msg.topic})
+
+def ingest_location(device, item):
+    payload, received_at = item
+    lat = payload.get("lat")
+    lon = payload.get("lon")
+    db = SessionLocal()
+    try:
+        dt = datetime.fromtimestamp(payload.get("tst"))
+        truck = db.query(Truck).filter_by(vin=device).first()
+        if not truck:
+            dummy_driver = Driver(name="OwnTracks", license_number="OWN123", contact="0000000000")
+            db.add(dummy_driver)
             db.commit()
-            print(f"📍 Location logged for {device} at {dt} [Trip ID: {active_trip_id}]")
+            db.refresh(dummy_driver)
 
-            websocket_data = {
-                "device": device,
-                "lat": lat,
-                "lon": lon,
-                "timestamp": dt.isoformat(),
-                "speed": payload.get("vel", 0.0)
-            }
-            broadcast_location_sync(websocket_data)
+            truck = Truck(vin=device, driver_id=dummy_driver.driver_id)
+            db.add(truck)
+            db.commit()
+            logger.info("registered new truck", extra={"vin": device})
 
-        else:
-            print("⚠️ Incomplete payload:", payload)
+        active_trip = db.query(Trip).filter_by(vin=device, status="active").first()
+        active_trip_id = active_trip.trip_id if active_trip else None
+        active_plan_id = active_trip.plan_id if active_trip else None
 
-    except json.JSONDecodeError:
-        print("❌ Failed to decode JSON")
-    except Exception as e:
-        if db:
-            db.rollback()
-        print("💥 MQTT Handler Error:", e)
+        log = LocationLog(
+            vin=device,
+            trip_id=active_trip_id,
+            timestamp=dt,
+            latitude=lat,
+            longitude=lon,
+            speed=payload.get("vel", 0.0)
+        )
+        db.add(log)
+        db.flush()
+        # The rollup is derived data: its own savepoint, so a failure there
+        # cannot roll back the raw fix.
+        try:
+            with db.begin_nested():
+                rollups.update_rollups(db, device, dt, lat, lon, payload.get("vel", 0.0))
+        except Exception:
+            rollups.forget(device)
+            metrics.ROLLUP_ERRORS.inc()
+            logger.exception("rollup update failed", extra={"vin": device})
+        db.commit()
+        metrics.INGEST_SECONDS.observe(time.perf_counter() - received_at, stage="commit")
+        logger.debug("location logged", extra={"vin": device, "timestamp": dt, "trip_id": active_trip_id})
+
+        websocket_data = location_message(device, lat, lon, dt, payload.get("vel", 0.0))
+        broadcast_location_sync(websocket_data, received_at=received_at)
+
+        if active_plan_id:
+            for event in route_monitor.check_fix(db, active_trip_id, active_plan_id, device, lat, lon, payload.get("vel", 0.0)):
+                broadcast_location_sync(event)
+        metrics.INGEST_MESSAGES.inc(result="logged")
+
+    except Exception:
+        db.rollback()
+        rollups.forget(device)
+        metrics.INGEST_MESSAGES.inc(result="error")
+        logger.exception("location ingest error", extra={"vin": device})
     finally:
-        if db:
+        db.close()
+
+ingest_downsampler = rate_limit.Downsampler(rate_limit.INGEST_FIXES_PER_SECOND, ingest_location)
+
+# Created in startup_event; benchmarks swap in their own client before that.
+mqtt_client = None
+
+def create_mqtt_client():
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client()
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.reconnect_delay_set(min_delay=1, max_delay=60)
+    return client
+
+async def seed_fleet_state():
+    from app import websocket_utils
+
+    def load():
+        db = SessionLocal()
+        try:
+            return websocket_utils.load_seed(db)
+        finally:
             db.close()
 
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
+    try:
+        fixes, trips = await asyncio.to_thread(load)
+    except Exception:
+        # Snapshots then start empty and fill up from live events.
+        logger.exception("failed to seed fleet state")
+        return
+    trucks, active = websocket_utils.apply_seed(fixes, trips)
+    logger.info("seeded fleet state", extra={"trucks": trucks, "active_trips": active})
 
 @app.on_event("startup")
 async def startup_event():
-    import websocket_utils  # make sure you import this at the top
+    global mqtt_client
+    from app import websocket_utils
     websocket_utils.main_loop = asyncio.get_running_loop()  # ✅ correctly share loop
-    print("Starting MQTT client...")
-    mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    # In the background: serving starts without waiting for the database.
+    asyncio.create_task(seed_fleet_state())
+    asyncio.create_task(binary_flush_loop())
+    ingest_downsampler.start()
+    logger.info("starting MQTT client", extra={"broker": MQTT_BROKER})
+    if mqtt_client is None:
+        mqtt_client = create_mqtt_client()
+    # The network thread connects and keeps retrying with backoff, so a slow
+    # or unreachable broker does not hold up serving HTTP.
+    mqtt_client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
     mqtt_client.loop_start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    mqtt_client.loop_stop()
-    mqtt_client.disconnect()
+    if mqtt_client is not None:
+        mqtt_client.disconnect()
+        mqtt_client.loop_stop()
+    ingest_downsampler.stop()
+    stop_logging()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app:app", host="127.0.0.1", port=8000, reload=True)
+    uvicorn.run("app.app:app", host="127.0.0.1", port=8000, reload=True)
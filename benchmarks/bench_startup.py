@@ -0,0 +1,58 @@
+# Startup cost of the API process: wall time to import app.app and a
+# per-package breakdown from python -X importtime.
+#   python -m app.benchmarks.bench_startup --runs 5 --top 15
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.app; print(time.perf_counter() - t)"
+
+
+def import_once():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_SNIPPET],
+        cwd=PACKAGE_PARENT, capture_output=True, text=True, check=True
+    )
+    wall = float(result.stdout.strip().splitlines()[-1])
+
+    # Lines look like "import time:      self |  cumulative | <indent>module".
+    # Top-level imports have no indent, their cumulative time includes children.
+    per_package = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  "):
+            continue
+        per_package[name.strip().split(".")[0]] += int(cumulative)
+    return wall, per_package
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    walls, breakdowns = [], []
+    for _ in range(args.runs):
+        wall, per_package = import_once()
+        walls.append(wall)
+        breakdowns.append(per_package)
+
+    print(f"import app.app: median {statistics.median(walls) * 1000:.1f} ms, "
+          f"min {min(walls) * 1000:.1f} ms over {args.runs} runs")
+    packages = {name for b in breakdowns for name in b}
+    medians = {name: statistics.median(b.get(name, 0) for b in breakdowns) for name in packages}
+    print(f"\n{'package':<30}{'cumulative ms':>15}")
+    for name, us in sorted(medians.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<30}{us / 1000:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
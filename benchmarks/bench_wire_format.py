@@ -0,0 +1,87 @@
+# Compares the JSON text feed with the batched binary feed of /ws/location.
+# Run from the directory containing the app package:
+#   python -m app.benchmarks.bench_wire_format --trucks 500 --ticks 40
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.wire_format import FixEncoder, decode_frame
+
+
+def simulate_ticks(trucks, ticks, seed=42):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    positions = {
+        f"TRUCK{i:05d}": [28.6 + rng.uniform(-0.5, 0.5), 77.2 + rng.uniform(-0.5, 0.5)]
+        for i in range(trucks)
+    }
+    for tick in range(ticks):
+        now = start + timedelta(seconds=tick)
+        batch = []
+        for vin, pos in positions.items():
+            pos[0] += rng.uniform(-0.0003, 0.0003)
+            pos[1] += rng.uniform(-0.0003, 0.0003)
+            batch.append({
+                "device": vin,
+                "lat": round(pos[0], 6),
+                "lon": round(pos[1], 6),
+                "timestamp": now.isoformat(),
+                "speed": float(rng.randint(0, 90))
+            })
+        yield batch
+
+
+def bench_json(ticks):
+    total_bytes = updates = 0
+    elapsed = 0.0
+    for batch in ticks:
+        t0 = time.perf_counter()
+        frames = [json.dumps(fix) for fix in batch]
+        elapsed += time.perf_counter() - t0
+        total_bytes += sum(len(f.encode()) for f in frames)
+        updates += len(batch)
+    return total_bytes, updates, elapsed
+
+
+def bench_binary(ticks):
+    encoder = FixEncoder()
+    state = {}
+    total_bytes = updates = 0
+    elapsed = 0.0
+    for batch in ticks:
+        t0 = time.perf_counter()
+        frame = encoder.encode(batch)
+        elapsed += time.perf_counter() - t0
+        decoded = decode_frame(frame, state)
+        assert len(decoded) == len(batch)
+        assert abs(decoded[-1]["lat"] - batch[-1]["lat"]) < 1e-6
+        total_bytes += len(frame)
+        updates += len(batch)
+    return total_bytes, updates, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trucks", type=int, default=500)
+    parser.add_argument("--ticks", type=int, default=40)
+    args = parser.parse_args()
+
+    ticks = list(simulate_ticks(args.trucks, args.ticks))
+    print(f"{args.trucks} trucks x {args.ticks} ticks")
+    print(f"{'encoding':<10}{'bytes/update':>14}{'encode us/update':>18}{'frames/tick':>13}")
+    for name, bench, frames_per_tick in (
+        ("json", bench_json, args.trucks),
+        ("binary", bench_binary, 1),
+    ):
+        total_bytes, updates, elapsed = bench(ticks)
+        print(f"{name:<10}{total_bytes / updates:>14.1f}{elapsed / updates * 1e6:>18.2f}{frames_per_tick:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+import math
+import queue
+import random
+import threading
+import time
+
+
+class MQTTMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class InProcessBroker:
+    # Stands in for paho's client: app.startup_event calls connect/loop_start
+    # on it and messages are delivered to on_message from a single network
+    # thread, like paho does.
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_message = None
+        self.latencies = []
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def connect(self, *args, **kwargs):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0)
+
+    connect_async = connect
+
+    def subscribe(self, topic):
+        pass
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def loop_start(self):
+        self._thread = threading.Thread(target=self._deliver, daemon=True)
+        self._thread.start()
+
+    def loop_stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, payload):
+        self._queue.put((time.perf_counter(), MQTTMessage(topic, payload)))
+
+    def drain(self):
+        self._queue.join()
+
+    def _deliver(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                published_at, msg = item
+                self.on_message(self, None, msg)
+                self.latencies.append(time.perf_counter() - published_at)
+            finally:
+                self._queue.task_done()
+
+
+def load_routes(path):
+    # A JSON list of polylines, each a list of [lat, lon] points.
+    with open(path) as f:
+        return json.load(f)
+
+
+def random_route(rng, center=(28.6139, 77.2090), legs=20, leg_km=2.0):
+    lat, lon = center[0] + rng.uniform(-0.3, 0.3), center[1] + rng.uniform(-0.3, 0.3)
+    route = [[lat, lon]]
+    for _ in range(legs):
+        bearing = rng.uniform(0, 2 * math.pi)
+        lat += leg_km / 111.0 * math.cos(bearing)
+        lon += leg_km / (111.0 * math.cos(math.radians(lat))) * math.sin(bearing)
+        route.append([lat, lon])
+    return route
+
+
+class Truck:
+    def __init__(self, vin, route, speed_kmph):
+        self.vin = vin
+        self.route = route
+        self.speed_kmph = speed_kmph
+        self.leg = 0
+        self.progress_km = 0.0
+
+    def advance(self, seconds):
+        self.progress_km += self.speed_kmph * seconds / 3600
+        while True:
+            (lat1, lon1), (lat2, lon2) = self.route[self.leg], self.route[(self.leg + 1) % len(self.route)]
+            leg_km = math.hypot(lat2 - lat1, (lon2 - lon1) * math.cos(math.radians(lat1))) * 111.0
+            if self.progress_km <= leg_km or leg_km == 0:
+                f = self.progress_km / leg_km if leg_km else 0
+                return lat1 + (lat2 - lat1) * f, lon1 + (lon2 - lon1) * f
+            self.progress_km -= leg_km
+            self.leg = (self.leg + 1) % len(self.route)
+
+
+class FleetSimulator:
+    def __init__(self, trucks, report_interval=1.0, routes=None, seed=42, vin_prefix="BENCH"):
+        rng = random.Random(seed)
+        self.report_interval = report_interval
+        self.trucks = [
+            Truck(
+                f"{vin_prefix}{i:05d}",
+                routes[i % len(routes)] if routes else random_route(rng),
+                rng.uniform(30, 90)
+            )
+            for i in range(trucks)
+        ]
+        self.clock = int(time.time())
+
+    def tick(self):
+        # One OwnTracks location report per truck, one report_interval later.
+        self.clock += max(1, round(self.report_interval))
+        for truck in self.trucks:
+            lat, lon = truck.advance(self.report_interval)
+            yield truck.vin, {
+                "_type": "location",
+                "tid": truck.vin,
+                "lat": round(lat, 6),
+                "lon": round(lon, 6),
+                "tst": self.clock,
+                "vel": round(truck.speed_kmph)
+            }
@@ -0,0 +1,38 @@
+from math import radians, cos, sin, sqrt, atan2
+
+# shapely (and numpy behind it) is only imported the first time a point is
+# built, not when the app module is imported.
+
+def make_point(lon, lat):
+    from geoalchemy2.shape import from_shape
+    from shapely.geometry import Point
+    return from_shape(Point(lon, lat), srid=4326)
+
+
+def make_linestring(coords):
+    # coords are (lon, lat) pairs.
+    from geoalchemy2.shape import from_shape
+    from shapely.geometry import LineString
+    return from_shape(LineString(coords), srid=4326)
+
+
+def to_shape(geography):
+    from geoalchemy2.shape import to_shape as _to_shape
+    return _to_shape(geography)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = 6371
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    return R * c
+
+
+def path_distance_km(points):
+    # points are anything with .latitude/.longitude, in travel order.
+    return sum(
+        haversine(points[i - 1].latitude, points[i - 1].longitude, points[i].latitude, points[i].longitude)
+        for i in range(1, len(points))
+    )
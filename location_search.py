@@ -1,4 +1,22 @@
-import requests
+import os
+from functools import lru_cache
+
+ORS_API_KEY = os.getenv("ORS_API_KEY", "5b3ce3597851110001cf6248e1d8e314ca754bc68acfb5b1aaa27ca5")
+
+
+@lru_cache(maxsize=None)
+def get_ors_client():
+    import openrouteservice
+    return openrouteservice.Client(key=ORS_API_KEY)
+
+
+@lru_cache(maxsize=None)
+def _http_session():
+    import requests
+    session = requests.Session()
+    session.headers["User-Agent"] = "fleet-tracker"
+    return session
+
 
 def geocode_place(place_name):
     url = "https://nominatim.openstreetmap.org/search"
@@ -7,7 +25,7 @@ def geocode_place(place_name):
         "format": "json",
         "limit": 1
     }
-    resp = requests.get(url, params=params, headers={"User-Agent": "fleet-tracker"})
+    resp = _http_session().get(url, params=params)
     resp.raise_for_status()
     results = resp.json()
     if not results:
@@ -15,3 +33,10 @@ def geocode_place(place_name):
     lat = float(results[0]["lat"])
     lon = float(results[0]["lon"])
     return lat, lon
+
+
+def route_coordinates(directions):
+    # ORS returns the route as an encoded polyline; decode it to [lon, lat] pairs.
+    from openrouteservice import convert
+    geometry = directions["routes"][0]["geometry"]
+    return convert.decode_polyline(geometry)["coordinates"]
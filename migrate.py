@@ -0,0 +1,33 @@
+# Brings an existing database up to the current models. create_all() only
+# creates missing tables, so new columns and indexes on existing tables ship
+# as SQL files in migrations/ and are applied in name order. Every statement
+# is idempotent (IF NOT EXISTS), so running this again is harmless.
+#   python -m app.migrate
+import glob
+import logging
+import os
+from app.database import engine
+
+logger = logging.getLogger("fleet.migrate")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def migrate():
+    applied = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        with open(path) as f, engine.begin() as conn:
+            conn.exec_driver_sql(f.read())
+        applied.append(os.path.basename(path))
+        logger.info("applied migration", extra={"migration": applied[-1]})
+    return applied
+
+
+if __name__ == "__main__":
+    from app.logging_setup import setup_logging, stop_logging
+
+    setup_logging()
+    try:
+        migrate()
+    finally:
+        stop_logging()
@@ -0,0 +1,2 @@
+-- Keyset paging and seeking through a trip's fixes (trip replay, /trip/{id}/points).
+CREATE INDEX IF NOT EXISTS ix_location_log_trip_time ON location_log (trip_id, timestamp, log_id);
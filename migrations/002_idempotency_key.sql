@@ -0,0 +1,9 @@
+-- Stored responses of the batch trip endpoints, keyed by Idempotency-Key.
+CREATE TABLE IF NOT EXISTS idempotency_key (
+    key VARCHAR NOT NULL PRIMARY KEY,
+    endpoint VARCHAR NOT NULL,
+    request_hash VARCHAR,
+    response TEXT NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now()
+);
+ALTER TABLE idempotency_key ADD COLUMN IF NOT EXISTS request_hash VARCHAR;
@@ -0,0 +1,13 @@
+-- Per-truck time-bucket rollups maintained on ingest.
+CREATE TABLE IF NOT EXISTS truck_rollup (
+    vin TEXT NOT NULL REFERENCES truck (vin),
+    bucket VARCHAR NOT NULL,
+    bucket_start TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    distance_km FLOAT,
+    moving_seconds FLOAT,
+    max_speed FLOAT,
+    speed_sum FLOAT,
+    fix_count INTEGER,
+    PRIMARY KEY (vin, bucket, bucket_start)
+);
+CREATE INDEX IF NOT EXISTS ix_truck_rollup_bucket_start ON truck_rollup (bucket, bucket_start);
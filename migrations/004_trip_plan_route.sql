@@ -0,0 +1,2 @@
+-- Planned route geometry used for deviation monitoring.
+ALTER TABLE trip_plan ADD COLUMN IF NOT EXISTS route geography(LINESTRING, 4326);
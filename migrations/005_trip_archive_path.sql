@@ -0,0 +1,2 @@
+-- Parquet file (relative to ARCHIVE_DIR) holding an archived trip's fixes.
+ALTER TABLE trip ADD COLUMN IF NOT EXISTS archive_path VARCHAR;
@@ -0,0 +1,2 @@
+-- Newest fix per truck for the startup seed of the live feed snapshot.
+CREATE INDEX IF NOT EXISTS ix_location_log_vin_time ON location_log (vin, timestamp, log_id);
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime,text,Interval
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, DateTime,text,Interval, Index
 from sqlalchemy.orm import relationship
 from geoalchemy2 import Geography
 from app.database import Base
@@ -44,6 +44,13 @@ class LocationLog(Base):
     longitude = Column(Float)
     speed = Column(Float)
 
+    # Keyset index used to page and seek through a trip in time order, and
+    # one to find each truck's newest fix without scanning the table.
+    __table_args__ = (
+        Index("ix_location_log_trip_time", "trip_id", "timestamp", "log_id"),
+        Index("ix_location_log_vin_time", "vin", "timestamp", "log_id"),
+    )
+
 
 class Trip(Base):
     __tablename__ = "trip"
@@ -62,9 +69,21 @@ class Trip(Base):
     end_lat = Column(Float)
     end_lon = Column(Float)
     fuel_consumed_litres = Column(Float)
+    archive_path = Column(String, nullable=True)
     comparison = relationship("TripComparison", back_populates="trip", uselist=False)
     
     
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+
+    key = Column(String, primary_key=True)
+    endpoint = Column(String, nullable=False)
+    # sha256 of the request body, a reused key must come with the same body.
+    request_hash = Column(String)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=text("now()"))
+
+
 class TripPlan(Base):
     __tablename__ = "trip_plan"
 
@@ -74,6 +93,7 @@ class TripPlan(Base):
     expected_distance_km = Column(Float)
     expected_time_minutes = Column(Float)
     expected_avg_speed = Column(Float)
+    route = Column(Geography(geometry_type="LINESTRING", srid=4326), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)  
 
 class TruckStats(Base):
@@ -87,6 +107,20 @@ class TruckStats(Base):
     average_speed_kmph = Column(Float, default=0)
     last_updated = Column(DateTime, server_default=text('now()'))
 
+class TruckRollup(Base):
+    __tablename__ = "truck_rollup"
+
+    vin = Column(Text, ForeignKey("truck.vin"), primary_key=True)
+    bucket = Column(String, primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    distance_km = Column(Float, default=0)
+    moving_seconds = Column(Float, default=0)
+    max_speed = Column(Float, default=0)
+    speed_sum = Column(Float, default=0)
+    fix_count = Column(Integer, default=0)
+
+    __table_args__ = (Index("ix_truck_rollup_bucket_start", "bucket", "bucket_start"),)
+
 class TripComparison(Base):
     __tablename__ = "trip_comparison"
 
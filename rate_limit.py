@@ -0,0 +1,224 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from app import metrics
+
+logger = logging.getLogger("fleet.ratelimit")
+
+# RATE_LIMITS=off disables every limit below, e.g. for load benchmarks.
+ENABLED = os.getenv("RATE_LIMITS", "on") != "off"
+# Per client IP and route template: (requests per second, burst).
+ROUTE_LIMITS = {
+    "/truck/stats/{vin}": (2, 10),
+    "/driver/analytics/{driver_id}": (2, 10),
+    "/driver/efficiency/leaderboard": (1, 5),
+    "/truck/efficiency/leaderboard": (1, 5),
+    "/truck/{vin}/timeseries": (2, 10),
+    "/fleet/timeseries": (2, 10),
+}
+DEFAULT_ROUTE_LIMIT = (20, 40)
+# Requests in flight across all clients for the expensive endpoints.
+CONCURRENCY_LIMITS = {
+    "/trip/end": 4,
+    "/trip/plan": 4,
+    "/trips/start:batch": 2,
+    "/trips/end:batch": 2,
+}
+# Per client IP, for /ws/location and /ws/replay.
+WEBSOCKET_CONNECT_LIMIT = (1, 5)
+# Per device on the MQTT ingest path, per second of the fixes' own timestamps.
+INGEST_FIXES_PER_SECOND = float(os.getenv("INGEST_FIXES_PER_SECOND", "1"))
+
+_STOP = object()
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        # Returns 0 when a token was taken, else the seconds until one is available.
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class KeyedLimiter:
+    def __init__(self, rate, burst, max_keys=10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    # The oldest idle key has long since refilled to a full bucket.
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take()
+
+
+class ConcurrencyLimit:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class Downsampler:
+    # Thins each key's items to at most `rate` per second of the items' own
+    # timestamps (device time, not arrival time): a phone flushing its
+    # buffered backlog after a dead zone keeps its real history, while a
+    # 10 Hz publisher is cut down. An item too close to the last one kept is
+    # parked rather than dropped, replacing an older parked item; if nothing
+    # newer is kept within hold_seconds it is delivered then, so a device
+    # that floods and then goes quiet still ends on its latest position.
+    #
+    # Every handler call runs on one worker thread, and a parked item is only
+    # delivered once none of its key's earlier items are still queued, so
+    # each key's items are handled in timestamp order.
+
+    def __init__(self, rate, handler, hold_seconds=1.0, max_queued=1000):
+        self.min_interval = 1.0 / rate if rate else 0.0
+        self.handler = handler
+        self.hold_seconds = hold_seconds
+        self._last = {}     # key -> timestamp of the newest item kept
+        self._parked = {}   # key -> (timestamp, item, parked at)
+        self._queued = {}   # key -> items queued but not yet handled
+        self._lock = threading.Lock()
+        # Bounded so a slow handler pushes back on the submitting thread.
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+
+    def submit(self, key, item, timestamp):
+        with self._lock:
+            last = self._last.get(key)
+            if ENABLED and last is not None and timestamp - last < self.min_interval:
+                parked = self._parked.get(key)
+                if timestamp > last and (parked is None or timestamp >= parked[0]):
+                    self._parked[key] = (timestamp, item, time.monotonic())
+                metrics.RATE_LIMITED.inc(scope="ingest", route="mqtt")
+                return False
+            if last is None or timestamp > last:
+                self._last[key] = timestamp
+            # Newer than anything parked for the key, which it supersedes.
+            self._parked.pop(key, None)
+            self._queued[key] = self._queued.get(key, 0) + 1
+        self._queue.put((key, item))
+        return True
+
+    def _handle(self, key, item):
+        try:
+            self.handler(key, item)
+        except Exception:
+            logger.exception("downsampler handler error", extra={"key": key})
+
+    def _release_parked(self):
+        now = time.monotonic()
+        with self._lock:
+            ready = [
+                key for key, (_, _, parked_at) in self._parked.items()
+                if now - parked_at >= self.hold_seconds and key not in self._queued
+            ]
+            items = []
+            for key in ready:
+                timestamp, item, _ = self._parked.pop(key)
+                self._last[key] = timestamp
+                items.append((key, item))
+        for key, item in items:
+            self._handle(key, item)
+
+    def _run(self):
+        next_release = time.monotonic() + self.hold_seconds
+        while True:
+            try:
+                entry = self._queue.get(timeout=max(0.0, next_release - time.monotonic()))
+            except queue.Empty:
+                entry = None
+            if entry is not None:
+                try:
+                    if entry is _STOP:
+                        return
+                    key, item = entry
+                    self._handle(key, item)
+                    with self._lock:
+                        self._queued[key] -= 1
+                        if not self._queued[key]:
+                            del self._queued[key]
+                finally:
+                    self._queue.task_done()
+            if time.monotonic() >= next_release:
+                self._release_parked()
+                next_release = time.monotonic() + min(self.hold_seconds, 1.0)
+
+    def drain(self):
+        # Blocks until everything queued so far has been handled.
+        self._queue.join()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ingest-downsampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+
+_route_limiters = {}
+_concurrency_limits = {route: ConcurrencyLimit(limit) for route, limit in CONCURRENCY_LIMITS.items()}
+websocket_connects = KeyedLimiter(*WEBSOCKET_CONNECT_LIMIT)
+
+
+def check_route(client, route):
+    # Seconds to wait before retrying, or 0 when the request may proceed.
+    if not ENABLED:
+        return 0.0
+    limiter = _route_limiters.get(route)
+    if limiter is None:
+        limiter = _route_limiters.setdefault(route, KeyedLimiter(*ROUTE_LIMITS.get(route, DEFAULT_ROUTE_LIMIT)))
+    retry_after = limiter.take(client)
+    if retry_after:
+        metrics.RATE_LIMITED.inc(scope="client", route=route)
+    return retry_after
+
+
+def concurrency_limit(route):
+    return _concurrency_limits.get(route) if ENABLED else None
+
+
+def allow_websocket(client, route):
+    if ENABLED and websocket_connects.take(client):
+        metrics.RATE_LIMITED.inc(scope="websocket", route=route)
+        return False
+    return True
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# In-memory cache for read endpoints whose data only changes when a trip ends
+# or a truck/driver is registered. Entries carry tags and are dropped by the
+# events that change them (see invalidate_for_event); the TTL only bounds
+# staleness from writes this process does not see, e.g. other workers.
+CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+MAX_ENTRIES = 1024
+
+# Route template -> tags for a response, from its path parameters.
+CACHED_ROUTES = {
+    "/truck/stats/{vin}": lambda params: [f"truck_stats:{params['vin']}"],
+    "/driver/analytics/{driver_id}": lambda params: [f"driver_analytics:{int(params['driver_id'])}"],
+    "/driver/efficiency/leaderboard": lambda params: ["driver_leaderboard"],
+    "/truck/efficiency/leaderboard": lambda params: ["truck_leaderboard"],
+}
+
+CacheEntry = namedtuple("CacheEntry", "body media_type etag tags expires")
+
+_entries = OrderedDict()
+_keys_by_tag = {}
+_lock = threading.Lock()
+# Bumped on every invalidation; a response computed across one is not stored.
+generation = 0
+
+
+def get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            _drop(key)
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def put(key, body, media_type, tags, computed_at_generation):
+    entry = CacheEntry(body, media_type, f'"{hashlib.sha1(body).hexdigest()}"', tuple(tags), time.monotonic() + CACHE_TTL_SECONDS)
+    with _lock:
+        if computed_at_generation != generation:
+            return entry
+        _drop(key)
+        _entries[key] = entry
+        for tag in entry.tags:
+            _keys_by_tag.setdefault(tag, set()).add(key)
+        if len(_entries) > MAX_ENTRIES:
+            _drop(next(iter(_entries)))
+    return entry
+
+
+def _drop(key):
+    entry = _entries.pop(key, None)
+    if entry is None:
+        return
+    for tag in entry.tags:
+        keys = _keys_by_tag.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _keys_by_tag[tag]
+
+
+def invalidate(*tags):
+    global generation
+    with _lock:
+        generation += 1
+        for tag in tags:
+            for key in list(_keys_by_tag.get(tag, ())):
+                _drop(key)
+
+
+def invalidate_for_event(event):
+    kind = event.get("type")
+    if kind == "trip_ended":
+        # TruckStats, the trip comparison and the truck's fuel efficiency all change.
+        invalidate(f"truck_stats:{event['vin']}", f"driver_analytics:{event.get('driver_id')}",
+                   "driver_leaderboard", "truck_leaderboard")
+    elif kind == "truck_registered":
+        invalidate(f"truck_stats:{event['vin']}", f"driver_analytics:{event.get('driver_id')}",
+                   "driver_leaderboard", "truck_leaderboard")
+    elif kind == "driver_registered":
+        invalidate(f"driver_analytics:{event['driver_id']}", "driver_leaderboard")
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
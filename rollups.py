@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import func
+from app.models import LocationLog, TruckRollup
+from app.geo_utils import haversine
+
+BUCKETS = {"1m": 60, "1h": 3600, "1d": 86400}
+MOVING_SPEED_KMPH = 3.0
+# A longer silence between fixes still adds distance but no moving time.
+MAX_MOVING_GAP_SECONDS = 300
+
+_EPOCH = datetime(1970, 1, 1)
+# vin -> (timestamp, lat, lon) of the newest fix already rolled up.
+_last_fix = {}
+
+
+def bucket_start(timestamp, seconds):
+    offset = (timestamp - _EPOCH).total_seconds() % seconds
+    return (timestamp - timedelta(seconds=offset)).replace(microsecond=0)
+
+
+def _previous_fix(db, vin, timestamp):
+    if vin in _last_fix:
+        return _last_fix[vin]
+    row = db.query(LocationLog.timestamp, LocationLog.latitude, LocationLog.longitude)\
+        .filter(LocationLog.vin == vin, LocationLog.timestamp < timestamp)\
+        .order_by(LocationLog.timestamp.desc())\
+        .first()
+    return tuple(row) if row else None
+
+
+def update_rollups(db, vin, timestamp, lat, lon, speed):
+    # Folds one fix into its 1m/1h/1d buckets with a single upsert. The
+    # segment from the truck's previous fix is credited to this fix's bucket.
+    speed = speed or 0.0
+    distance_km = moving_seconds = 0.0
+    prev = _previous_fix(db, vin, timestamp)
+    if prev and prev[0] < timestamp:
+        gap = (timestamp - prev[0]).total_seconds()
+        distance_km = haversine(prev[1], prev[2], lat, lon)
+        if gap <= MAX_MOVING_GAP_SECONDS and max(speed, distance_km / gap * 3600) >= MOVING_SPEED_KMPH:
+            moving_seconds = gap
+    if not prev or prev[0] < timestamp:
+        _last_fix[vin] = (timestamp, lat, lon)
+
+    stmt = insert(TruckRollup).values([
+        {
+            "vin": vin,
+            "bucket": name,
+            "bucket_start": bucket_start(timestamp, seconds),
+            "distance_km": distance_km,
+            "moving_seconds": moving_seconds,
+            "max_speed": speed,
+            "speed_sum": speed,
+            "fix_count": 1
+        }
+        for name, seconds in BUCKETS.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[TruckRollup.vin, TruckRollup.bucket, TruckRollup.bucket_start],
+        set_={
+            "distance_km": TruckRollup.distance_km + stmt.excluded.distance_km,
+            "moving_seconds": TruckRollup.moving_seconds + stmt.excluded.moving_seconds,
+            "max_speed": func.greatest(TruckRollup.max_speed, stmt.excluded.max_speed),
+            "speed_sum": TruckRollup.speed_sum + stmt.excluded.speed_sum,
+            "fix_count": TruckRollup.fix_count + 1
+        }
+    ))
+
+
+def forget(vin):
+    # Called when the fix's transaction is rolled back.
+    _last_fix.pop(vin, None)
@@ -0,0 +1,149 @@
+import time
+from bisect import bisect_left, bisect_right
+from math import cos, radians
+from app.models import TripPlan
+from app.geo_utils import haversine, to_shape
+
+# Hysteresis so a truck hovering around the threshold does not flap.
+DEVIATION_METERS = 200
+REJOIN_METERS = 100
+# Below this the truck is treated as stopped and the plan's average speed is used for the ETA.
+MIN_ETA_SPEED_KMPH = 5
+# A fix is matched against the route from BACKTRACK_KM behind the trip's
+# last position to MAX_JUMP_KM ahead of it, so routes that come back near
+# themselves (out-and-back, loops) stay on the right leg.
+BACKTRACK_KM = 0.2
+MAX_JUMP_KM = 2.0
+# route_progress is sent at most this often per trip; deviations always go out.
+PROGRESS_INTERVAL_SECONDS = 10
+
+
+class RouteIndex:
+    def __init__(self, coords, expected_avg_speed=None):
+        from shapely.geometry import LineString
+        from shapely.strtree import STRtree
+
+        # coords are (lon, lat) pairs along the planned route.
+        self.coords = [tuple(c[:2]) for c in coords]
+        self.expected_avg_speed = expected_avg_speed
+        self.cumulative_km = [0.0]
+        for (lon1, lat1), (lon2, lat2) in zip(self.coords, self.coords[1:]):
+            self.cumulative_km.append(self.cumulative_km[-1] + haversine(lat1, lon1, lat2, lon2))
+        self.total_km = self.cumulative_km[-1]
+        self.tree = STRtree([LineString([a, b]) for a, b in zip(self.coords, self.coords[1:])])
+
+    def _project(self, i, lat, lon):
+        # (km along the route, metres off it) for the fix projected onto
+        # segment i, in a local equirectangular plane, which is exact enough
+        # at segment scale.
+        (lon1, lat1), (lon2, lat2) = self.coords[i], self.coords[i + 1]
+        kx = cos(radians(lat))
+        dx, dy = (lon2 - lon1) * kx, lat2 - lat1
+        length2 = dx * dx + dy * dy
+        t = ((lon - lon1) * kx * dx + (lat - lat1) * dy) / length2 if length2 else 0.0
+        t = max(0.0, min(1.0, t))
+        plat, plon = lat1 + t * (lat2 - lat1), lon1 + t * (lon2 - lon1)
+
+        along_km = self.cumulative_km[i] + haversine(lat1, lon1, plat, plon)
+        off_route_m = haversine(lat, lon, plat, plon) * 1000
+        return along_km, off_route_m
+
+    def nearest(self, lat, lon):
+        # Globally nearest segment, O(log n) through the tree.
+        from shapely.geometry import Point
+
+        return self._project(int(self.tree.nearest(Point(lon, lat))), lat, lon)
+
+    def locate(self, lat, lon, last_km=None):
+        # Returns (km along the route, metres off it) for one fix, searching
+        # only the segments around last_km, the trip's previous position.
+        if last_km is None:
+            return self.nearest(lat, lon)
+
+        segments = len(self.coords) - 1
+        lo = min(max(bisect_left(self.cumulative_km, last_km - BACKTRACK_KM) - 1, 0), segments - 1)
+        hi = min(bisect_right(self.cumulative_km, last_km + MAX_JUMP_KM), segments)
+        along_km, off_route_m = min((self._project(i, lat, lon) for i in range(lo, hi)), key=lambda m: m[1])
+
+        if off_route_m > DEVIATION_METERS:
+            # Off the expected stretch: after a long gap in fixes the truck may
+            # be back on the route further along (or behind).
+            match = self.nearest(lat, lon)
+            if match[1] <= DEVIATION_METERS:
+                return match
+        return along_km, off_route_m
+
+
+class TripRoute:
+    __slots__ = ("route", "along_km", "off_route", "progress_sent")
+
+    def __init__(self, route):
+        self.route = route
+        self.along_km = None
+        self.off_route = False
+        self.progress_sent = 0.0
+
+
+# trip_id -> TripRoute for active planned trips, dropped when the trip ends.
+_trips = {}
+
+
+def _trip_route(db, trip_id, plan_id):
+    state = _trips.get(trip_id)
+    if state is None:
+        plan = db.query(TripPlan).filter_by(plan_id=plan_id).first()
+        route = None
+        if plan and plan.route is not None:
+            route = RouteIndex(to_shape(plan.route).coords, plan.expected_avg_speed)
+        state = _trips[trip_id] = TripRoute(route)
+    return state
+
+
+def forget(trip_id):
+    _trips.pop(trip_id, None)
+
+
+def on_event(event):
+    if event.get("type") == "trip_ended":
+        forget(event["trip_id"])
+
+
+def check_fix(db, trip_id, plan_id, vin, lat, lon, speed):
+    # Returns the events to broadcast for one fix of an active planned trip.
+    state = _trip_route(db, trip_id, plan_id)
+    route = state.route
+    if route is None:
+        return []
+
+    along_km, off_route_m = route.locate(lat, lon, state.along_km)
+    state.along_km = along_km
+    events = []
+
+    was_off = state.off_route
+    is_off = off_route_m > (REJOIN_METERS if was_off else DEVIATION_METERS)
+    if is_off != was_off:
+        state.off_route = is_off
+        events.append({
+            "type": "route_deviation" if is_off else "route_rejoined",
+            "trip_id": trip_id,
+            "vin": vin,
+            "lat": lat,
+            "lon": lon,
+            "off_route_m": round(off_route_m, 1)
+        })
+
+    now = time.monotonic()
+    if events or now - state.progress_sent >= PROGRESS_INTERVAL_SECONDS:
+        state.progress_sent = now
+        remaining_km = max(route.total_km - along_km, 0.0)
+        eta_speed = speed if speed and speed >= MIN_ETA_SPEED_KMPH else route.expected_avg_speed
+        events.insert(0, {
+            "type": "route_progress",
+            "trip_id": trip_id,
+            "vin": vin,
+            "along_km": round(along_km, 3),
+            "remaining_km": round(remaining_km, 3),
+            "off_route_m": round(off_route_m, 1),
+            "eta_minutes": round(remaining_km / eta_speed * 60, 1) if eta_speed else None
+        })
+    return events
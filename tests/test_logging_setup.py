@@ -0,0 +1,40 @@
+import json
+import logging
+import os
+import queue
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.logging_setup import JsonFormatter, _QueueHandler
+
+
+def log_through_queue(emit):
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger("fleet.test")
+    logger.propagate = False
+    handler = _QueueHandler(log_queue)
+    logger.addHandler(handler)
+    try:
+        emit(logger)
+    finally:
+        logger.removeHandler(handler)
+    return json.loads(JsonFormatter().format(log_queue.get_nowait()))
+
+
+def test_exception_traceback_is_kept_apart_from_msg():
+    def emit(logger):
+        try:
+            raise ValueError("bad payload")
+        except ValueError:
+            logger.exception("MQTT handler error %s", "x", extra={"topic": "t"})
+
+    data = log_through_queue(emit)
+    assert data["msg"] == "MQTT handler error x"
+    assert data["topic"] == "t"
+    assert "ValueError: bad payload" in data["exc"]
+
+
+def test_plain_record_has_no_exc():
+    data = log_through_queue(lambda logger: logger.warning("hello %d", 3))
+    assert data["msg"] == "hello 3" and "exc" not in data
@@ -0,0 +1,165 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app import rate_limit
+from app.rate_limit import Downsampler, KeyedLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def limits_on(monkeypatch):
+    monkeypatch.setattr(rate_limit, "ENABLED", True)
+
+
+class Recorder:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.handled = []
+        self._lock = threading.Lock()
+
+    def __call__(self, key, item):
+        time.sleep(self.delay)
+        with self._lock:
+            self.handled.append((key, item))
+
+    def items(self, key):
+        return [item for k, item in self.handled if k == key]
+
+
+def test_token_bucket_allows_burst_then_refills(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.take() == 0.0
+    clock.now += 60
+    assert [bucket.take() for _ in range(4)][-1] > 0
+
+
+def test_keyed_limiter_evicts_oldest_key(clock):
+    limiter = KeyedLimiter(rate=1, burst=1, max_keys=2)
+    assert limiter.take("a") == 0.0
+    assert limiter.take("b") == 0.0
+    assert limiter.take("c") == 0.0
+    assert list(limiter._buckets) == ["b", "c"]
+    # "a" starts over with a full bucket.
+    assert limiter.take("a") == 0.0
+    assert limiter.take("c") > 0
+
+
+def test_downsampler_thins_on_device_time():
+    handler = Recorder()
+    sampler = Downsampler(rate=1, handler=handler, hold_seconds=60)
+    sampler.start()
+    try:
+        # A buffered backlog arriving all at once, one fix per device second.
+        backlog = [sampler.submit("A", t, timestamp=t) for t in range(100, 130)]
+        # A 10 Hz publisher.
+        flood = [sampler.submit("B", t, timestamp=t / 10) for t in range(1000, 1030)]
+        sampler.drain()
+    finally:
+        sampler.stop()
+
+    assert all(backlog) and handler.items("A") == list(range(100, 130))
+    assert sum(flood) == 3 and handler.items("B") == [1000, 1010, 1020]
+
+
+def test_downsampler_drops_fixes_older_than_the_last_kept():
+    handler = Recorder()
+    sampler = Downsampler(rate=1, handler=handler, hold_seconds=0.05)
+    sampler.start()
+    try:
+        assert sampler.submit("A", "new", timestamp=200)
+        assert not sampler.submit("A", "stale", timestamp=150)
+        time.sleep(0.2)
+    finally:
+        sampler.stop()
+
+    assert handler.items("A") == ["new"]
+
+
+def test_downsampler_delivers_newest_parked_fix_when_device_goes_quiet():
+    handler = Recorder()
+    sampler = Downsampler(rate=1, handler=handler, hold_seconds=0.05)
+    sampler.start()
+    try:
+        assert sampler.submit("A", "first", timestamp=100.0)
+        assert not sampler.submit("A", "between", timestamp=100.3)
+        assert not sampler.submit("A", "latest", timestamp=100.6)
+        time.sleep(0.2)
+    finally:
+        sampler.stop()
+
+    assert handler.items("A") == ["first", "latest"]
+
+
+def test_downsampler_keeps_each_keys_order_behind_a_busy_queue():
+    handler = Recorder(delay=0.02)
+    sampler = Downsampler(rate=2, handler=handler, hold_seconds=0.01)
+    sampler.start()
+    try:
+        for i in range(8):
+            sampler.submit(f"other-{i}", i, timestamp=100)
+        assert sampler.submit("A", "first", timestamp=100.0)
+        assert not sampler.submit("A", "second", timestamp=100.2)
+        # The parked fix is due long before "first" leaves the queue.
+        time.sleep(0.4)
+    finally:
+        sampler.stop()
+
+    assert handler.items("A") == ["first", "second"]
+
+
+def test_downsampler_passes_everything_when_disabled(monkeypatch):
+    monkeypatch.setattr(rate_limit, "ENABLED", False)
+    handler = Recorder()
+    sampler = Downsampler(rate=1, handler=handler)
+    sampler.start()
+    try:
+        assert all(sampler.submit("A", i, timestamp=100) for i in range(5))
+        sampler.drain()
+    finally:
+        sampler.stop()
+
+    assert handler.items("A") == list(range(5))
+
+
+def test_downsampler_survives_handler_errors():
+    handled = []
+
+    def handler(key, item):
+        if item == "bad":
+            raise RuntimeError("boom")
+        handled.append(item)
+
+    sampler = Downsampler(rate=1, handler=handler)
+    sampler.start()
+    try:
+        sampler.submit("A", "bad", timestamp=100)
+        sampler.submit("A", "good", timestamp=101)
+        sampler.drain()
+    finally:
+        sampler.stop()
+
+    assert handled == ["good"]
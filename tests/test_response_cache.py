@@ -0,0 +1,88 @@
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app import response_cache as rc
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(rc, "_entries", OrderedDict())
+    monkeypatch.setattr(rc, "_keys_by_tag", {})
+    monkeypatch.setattr(rc, "generation", 0)
+
+
+def store(key, body, tags):
+    return rc.put(key, body, "application/json", tags, rc.generation)
+
+
+def test_etag_matches():
+    etag = store("/truck/stats/A", b'{"vin": "A"}', ["truck_stats:A"]).etag
+    assert rc.etag_matches(etag, etag)
+    assert rc.etag_matches(f"W/{etag}", etag)
+    assert rc.etag_matches(f'"other", {etag}', etag)
+    assert rc.etag_matches("*", etag)
+    assert not rc.etag_matches('"other"', etag)
+    assert not rc.etag_matches(None, etag)
+
+
+def test_same_body_same_etag():
+    first = store("/truck/stats/A", b"{}", ["truck_stats:A"])
+    second = store("/truck/stats/B", b"{}", ["truck_stats:B"])
+    assert first.etag == second.etag
+
+
+def test_invalidate_drops_only_tagged_entries():
+    store("/truck/stats/A", b"a", ["truck_stats:A"])
+    store("/truck/stats/B", b"b", ["truck_stats:B"])
+    store("/truck/efficiency/leaderboard", b"l", ["truck_leaderboard"])
+
+    rc.invalidate_for_event({"type": "trip_ended", "vin": "A", "driver_id": 1})
+
+    assert rc.get("/truck/stats/A") is None
+    assert rc.get("/truck/efficiency/leaderboard") is None
+    assert rc.get("/truck/stats/B").body == b"b"
+    assert set(rc._keys_by_tag) == {"truck_stats:B"}
+
+
+def test_driver_registration_only_drops_driver_entries():
+    store("/driver/analytics/3", b"d", ["driver_analytics:3"])
+    store("/truck/efficiency/leaderboard", b"l", ["truck_leaderboard"])
+
+    rc.invalidate_for_event({"type": "driver_registered", "driver_id": 3})
+
+    assert rc.get("/driver/analytics/3") is None
+    assert rc.get("/truck/efficiency/leaderboard") is not None
+
+
+def test_response_computed_across_an_invalidation_is_not_stored():
+    started_at = rc.generation
+    # A trip ends while the response is being computed.
+    rc.invalidate("truck_stats:A")
+    entry = rc.put("/truck/stats/A", b"stale", "application/json", ["truck_stats:A"], started_at)
+
+    assert entry.body == b"stale"
+    assert rc.get("/truck/stats/A") is None
+
+
+def test_expired_entry_is_dropped(monkeypatch):
+    store("/truck/stats/A", b"a", ["truck_stats:A"])
+    monkeypatch.setattr(rc.time, "monotonic", lambda: float("inf"))
+
+    assert rc.get("/truck/stats/A") is None
+    assert not rc._entries and not rc._keys_by_tag
+
+
+def test_oldest_entry_is_evicted(monkeypatch):
+    monkeypatch.setattr(rc, "MAX_ENTRIES", 2)
+    store("/truck/stats/A", b"a", ["truck_stats:A"])
+    store("/truck/stats/B", b"b", ["truck_stats:B"])
+    rc.get("/truck/stats/A")
+    store("/truck/stats/C", b"c", ["truck_stats:C"])
+
+    assert list(rc._entries) == ["/truck/stats/A", "/truck/stats/C"]
+    assert "truck_stats:B" not in rc._keys_by_tag
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app import route_monitor as rm
+from app.route_monitor import RouteIndex
+
+pytest.importorskip("shapely")
+
+LAT = 28.6
+# Roughly 50 m north of the outbound leg.
+RETURN_LAT = 28.6005
+
+
+def out_and_back():
+    # East along LAT for about 9.8 km, then back west just north of it.
+    out = [(77.0 + i / 100, LAT) for i in range(11)]
+    back = [(77.1 - i / 100, RETURN_LAT) for i in range(11)]
+    return RouteIndex(out + back, expected_avg_speed=40)
+
+
+@pytest.fixture(autouse=True)
+def no_trips(monkeypatch):
+    monkeypatch.setattr(rm, "_trips", {})
+
+
+def test_first_fix_uses_nearest_segment():
+    route = out_and_back()
+    along_km, off_m = route.locate(LAT, 77.05)
+    assert along_km == pytest.approx(route.cumulative_km[5], abs=0.01)
+    assert off_m < 1
+
+
+def test_overlapping_legs_stay_on_the_current_leg():
+    route = out_and_back()
+    # Midway between the two legs, so only the trip's last position tells them apart.
+    lat = (LAT + RETURN_LAT) / 2
+
+    outbound_km, _ = route.locate(lat, 77.05, last_km=route.cumulative_km[4])
+    return_km, _ = route.locate(lat, 77.05, last_km=route.cumulative_km[15])
+
+    assert outbound_km == pytest.approx(route.cumulative_km[5], abs=0.05)
+    assert return_km == pytest.approx(route.cumulative_km[16], abs=0.05)
+
+
+def test_jump_beyond_window_falls_back_to_nearest_on_route():
+    route = out_and_back()
+    # A long gap in fixes: the truck is back on the route well past MAX_JUMP_KM.
+    along_km, off_m = route.locate(LAT, 77.08, last_km=0.0)
+    assert along_km == pytest.approx(route.cumulative_km[8], abs=0.01)
+    assert off_m < 1
+
+
+def test_off_route_fix_stays_matched_to_the_window():
+    route = out_and_back()
+    # 1 km south of the first few km: off route, and nowhere near the return leg either.
+    along_km, off_m = route.locate(LAT - 0.009, 77.01, last_km=route.cumulative_km[1])
+    assert along_km < rm.MAX_JUMP_KM + route.cumulative_km[1]
+    assert off_m > rm.DEVIATION_METERS
+
+
+def test_check_fix_reports_deviation_and_rejoin_once(monkeypatch):
+    route = out_and_back()
+    rm._trips[7] = rm.TripRoute(route)
+    # The clock stands still, so progress only goes out with the first fix and with events.
+    monkeypatch.setattr(rm.time, "monotonic", lambda: 1e6)
+
+    def kinds(lat, lon):
+        return [e["type"] for e in rm.check_fix(None, 7, 1, "A", lat, lon, 40)]
+
+    assert kinds(LAT, 77.01) == ["route_progress"]
+    assert kinds(LAT, 77.02) == []
+    assert kinds(LAT - 0.003, 77.03) == ["route_progress", "route_deviation"]
+    # Between REJOIN_METERS and DEVIATION_METERS: still off route.
+    assert kinds(LAT - 0.0013, 77.04) == []
+    assert kinds(LAT, 77.05) == ["route_progress", "route_rejoined"]
+
+    rm.on_event({"type": "trip_ended", "trip_id": 7})
+    assert 7 not in rm._trips
@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fastapi import WebSocketDisconnect
+
+from app.trip_replay import ReplayControl, _read_commands
+
+
+class ScriptedSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def receive_text(self):
+        if not self.messages:
+            raise WebSocketDisconnect()
+        return self.messages.pop(0)
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+
+def run_commands(messages, speed=1.0):
+    ws, control = ScriptedSocket(messages), ReplayControl(speed)
+    asyncio.run(_read_commands(ws, 1, control))
+    return ws.sent, control
+
+
+def test_commands_update_control():
+    sent, control = run_commands([
+        json.dumps({"action": "pause"}),
+        json.dumps({"action": "speed", "speed": 5000}),
+        json.dumps({"action": "seek", "to": "2026-01-01T08:00:00"}),
+    ])
+    assert control.paused and control.speed == 1000.0
+    assert control.seek_to.isoformat() == "2026-01-01T08:00:00"
+    assert [m["type"] for m in sent] == ["replay_state"] * 3
+
+
+def test_non_object_commands_are_rejected_without_killing_the_reader():
+    sent, control = run_commands(['"pause"', "[]", "1", "null", "not json", json.dumps({"action": "resume"})])
+    assert [m["type"] for m in sent] == ["replay_error"] * 5 + ["replay_state"]
+
+
+def test_reader_exit_closes_the_replay():
+    _, control = run_commands([])
+    assert control.closed and control.changed.is_set()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import sys
+from collections import deque
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app import websocket_utils as wu
+from app.websocket_utils import EPOCH, location_message
+from app.wire_format import FixEncoder, decode_frame
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = None
+
+    async def _send(self, message):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    send_text = _send
+    send_bytes = _send
+
+    async def close(self, code=1000):
+        self.closed = code
+
+    def events(self):
+        return [json.loads(m) for m in self.sent if isinstance(m, str)]
+
+
+@pytest.fixture(autouse=True)
+def fresh_feed(monkeypatch):
+    monkeypatch.setattr(wu, "recent_events", deque(maxlen=wu.RECENT_EVENTS_MAX))
+    monkeypatch.setattr(wu, "last_seq", 0)
+    monkeypatch.setattr(wu, "fleet_state", {})
+    monkeypatch.setattr(wu, "active_trips", {})
+    monkeypatch.setattr(wu, "channels", {})
+    monkeypatch.setattr(wu, "active_websockets", set())
+    monkeypatch.setattr(wu, "binary_websockets", set())
+    monkeypatch.setattr(wu, "pending_fixes", [])
+    monkeypatch.setattr(wu, "binary_encoder", FixEncoder())
+
+
+def fix(device, minute=0):
+    return location_message(device, 28.6, 77.2, datetime(2026, 1, 1, 8, minute), 40.0)
+
+
+async def settle():
+    # Lets the per-client writer tasks drain their queues.
+    await asyncio.sleep(0.01)
+
+
+def test_events_since_resumes_within_epoch():
+    for i in range(3):
+        wu.record_event(fix("A", i))
+    assert [e["seq"] for e in wu.events_since(EPOCH, 1)] == [2, 3]
+    assert wu.events_since(EPOCH, 3) == []
+
+
+def test_events_since_rejects_other_epoch_and_future_seq():
+    for i in range(3):
+        wu.record_event(fix("A", i))
+    assert wu.events_since("another-run", 1) is None
+    assert wu.events_since(EPOCH, 4) is None
+
+
+def test_events_since_too_far_behind(monkeypatch):
+    monkeypatch.setattr(wu, "recent_events", deque(maxlen=2))
+    for i in range(5):
+        wu.record_event(fix("A", i))
+    assert wu.events_since(EPOCH, 1) is None
+    assert [e["seq"] for e in wu.events_since(EPOCH, 3)] == [4, 5]
+
+
+def test_snapshot_tracks_fleet_and_trips():
+    wu.record_event(fix("A"))
+    wu.record_event({"type": "trip_started", "vin": "A", "trip_id": 7})
+    wu.record_event({"type": "trip_started", "vin": "B", "trip_id": 8})
+    wu.record_event({"type": "trip_ended", "vin": "B", "trip_id": 8})
+
+    data = wu.snapshot()
+    assert data["epoch"] == EPOCH and data["seq"] == 4
+    assert data["active_trips"] == {"A": 7}
+    assert [t["device"] for t in data["trucks"]] == ["A"]
+    assert "trucks" not in wu.snapshot(include_trucks=False)
+
+
+def test_new_client_gets_snapshot_then_live_events():
+    async def run():
+        wu.record_event(fix("A"))
+        ws = FakeSocket()
+        await wu.register_client(ws)
+        await wu.broadcast_location(fix("A", 1))
+        await settle()
+        return ws.events()
+
+    events = asyncio.run(run())
+    assert events[0]["type"] == "snapshot" and events[0]["seq"] == 1
+    assert events[1]["seq"] == 2
+
+
+def test_resuming_client_gets_missed_events_only():
+    async def run():
+        for i in range(3):
+            wu.record_event(fix("A", i))
+        ws = FakeSocket()
+        await wu.register_client(ws, since=(EPOCH, 1))
+        await settle()
+        return ws.events()
+
+    assert [e["seq"] for e in asyncio.run(run())] == [2, 3]
+
+
+def test_slow_client_is_dropped_without_stalling_others(monkeypatch):
+    monkeypatch.setattr(wu, "SEND_TIMEOUT_SECONDS", 0.05)
+
+    async def run():
+        slow, fast = FakeSocket(delay=10), FakeSocket()
+        await wu.register_client(slow)
+        await wu.register_client(fast)
+        for i in range(3):
+            await wu.broadcast_location(fix("A", i))
+        await settle()
+        fast_events = len(fast.events())
+        await asyncio.sleep(0.1)
+        return slow, fast, fast_events
+
+    slow, fast, fast_events = asyncio.run(run())
+    assert fast_events == 4
+    assert slow.closed == 1013 and slow not in wu.active_websockets
+    assert fast in wu.active_websockets
+
+
+def test_client_that_falls_behind_is_dropped(monkeypatch):
+    monkeypatch.setattr(wu, "CLIENT_QUEUE_MAX", 3)
+
+    async def run():
+        stuck = FakeSocket(delay=10)
+        await wu.register_client(stuck)
+        for i in range(5):
+            await wu.broadcast_location(fix("A", i))
+        await settle()
+        return stuck
+
+    stuck = asyncio.run(run())
+    assert stuck.closed == 1013 and stuck not in wu.channels
+
+
+def test_failed_send_drops_client():
+    async def run():
+        broken = FakeSocket(fail=True)
+        await wu.register_client(broken)
+        await settle()
+        return broken
+
+    broken = asyncio.run(run())
+    assert broken not in wu.active_websockets and broken not in wu.channels
+
+
+def test_binary_client_gets_keyframe_and_batched_frames():
+    async def run():
+        ws = FakeSocket()
+        await wu.register_client(ws, binary=True)
+        await wu.broadcast_location(fix("A"))
+        await wu.broadcast_location(fix("B"))
+        await wu.flush_binary_fixes()
+        await settle()
+        return ws
+
+    ws = asyncio.run(run())
+    frames = [m for m in ws.sent if isinstance(m, bytes)]
+    state = {}
+    decode_frame(frames[0], state)
+    assert [f["device"] for f in decode_frame(frames[1], state)] == ["A", "B"]
+
+
+def test_seed_fills_snapshot_without_overriding_live_fixes():
+    wu.record_event(fix("A", 5))
+    trucks, trips = wu.apply_seed([fix("A", 1), fix("B", 2)], [("B", 9)])
+
+    assert (trucks, trips) == (1, 1)
+    data = wu.snapshot()
+    assert {t["device"]: t["timestamp"] for t in data["trucks"]} == {
+        "A": fix("A", 5)["timestamp"], "B": fix("B", 2)["timestamp"]
+    }
+    assert data["active_trips"] == {"B": 9}
+    assert wu.binary_encoder.vin_ids == {"B": 0}
@@ -0,0 +1,74 @@
+import os
+import struct
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.wire_format import FixEncoder, HEADER, VERSION, decode_frame
+
+
+def fix(device, lat, lon, timestamp, speed=0.0, seq=0):
+    return {"device": device, "lat": lat, "lon": lon, "timestamp": timestamp.isoformat(), "speed": speed, "seq": seq}
+
+
+def assert_same(decoded, sent):
+    assert len(decoded) == len(sent)
+    for got, want in zip(decoded, sent):
+        assert got["device"] == want["device"]
+        assert got["lat"] == pytest.approx(want["lat"], abs=1e-6)
+        assert got["lon"] == pytest.approx(want["lon"], abs=1e-6)
+        assert got["timestamp"] == want["timestamp"]
+        assert got["speed"] == pytest.approx(want["speed"], abs=0.1)
+
+
+def test_delta_frames_round_trip():
+    encoder, state = FixEncoder(), {}
+    start = datetime(2026, 1, 1, 8, 0, 0)
+    for tick in range(3):
+        sent = [
+            fix("A", 28.6 + tick * 1e-4, 77.2 - tick * 1e-4, start + timedelta(seconds=tick), 42.5, seq=tick * 2 + 1),
+            fix("B", -33.9, 151.2 + tick * 1e-3, start + timedelta(seconds=tick), 0.0, seq=tick * 2 + 2),
+        ]
+        assert_same(decode_frame(encoder.encode(sent), state), sent)
+        assert state["seq"] == tick * 2 + 2
+
+
+def test_keyframe_spanning_days_round_trips():
+    encoder, state = FixEncoder(), {}
+    sent = [
+        fix("A", 28.6, 77.2, datetime(2026, 1, 1, 0, 0, 0)),
+        fix("B", 19.07, 72.87, datetime(2026, 1, 2, 12, 0, 0)),
+        fix("C", 12.97, 77.59, datetime(2026, 3, 1, 6, 30, 15)),
+    ]
+    encoder.observe(sent)
+    assert_same(decode_frame(encoder.keyframe(), state), sent)
+
+
+def test_delta_with_buffered_old_fix_round_trips():
+    encoder, state = FixEncoder(), {}
+    now = datetime(2026, 1, 2, 12, 0, 0)
+    decode_frame(encoder.encode([fix("A", 28.6, 77.2, now)]), state)
+    sent = [
+        fix("B", 19.07, 72.87, now - timedelta(days=2)),
+        fix("A", 28.61, 77.21, now + timedelta(seconds=5)),
+    ]
+    assert_same(decode_frame(encoder.encode(sent), state), sent)
+
+
+def test_keyframe_resets_client_state():
+    encoder, state = FixEncoder(), {"vins": {99: "STALE"}, "last": {99: (1, 1)}}
+    sent = [fix("A", 28.6, 77.2, datetime(2026, 1, 1, 8, 0, 0))]
+    encoder.observe(sent)
+    assert_same(decode_frame(encoder.keyframe(), state), sent)
+    assert state["vins"] == {0: "A"}
+
+
+def test_unknown_version_is_rejected():
+    frame = bytearray(FixEncoder().encode([fix("A", 28.6, 77.2, datetime(2026, 1, 1))]))
+    struct.pack_into("<B", frame, 0, VERSION + 1)
+    with pytest.raises(ValueError):
+        decode_frame(bytes(frame), {})
+    assert HEADER.unpack_from(frame, 0)[0] == VERSION + 1
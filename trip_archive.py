@@ -0,0 +1,159 @@
+import argparse
+import logging
+import os
+from collections import namedtuple
+from functools import lru_cache
+from datetime import datetime, timedelta
+from sqlalchemy import func, tuple_
+from app.database import SessionLocal
+from app.models import Trip, LocationLog
+
+logger = logging.getLogger("fleet.archive")
+
+# Fixes of completed trips are moved out of location_log into one zstd
+# Parquet file per trip, laid out as
+#   ARCHIVE_DIR/month=YYYY-MM/vin=<vin>/trip_<trip_id>.parquet
+# Trip.archive_path holds the path relative to ARCHIVE_DIR. Files are written
+# in (timestamp, log_id) order so row-group statistics allow range scans.
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ROW_GROUP_SIZE = 10_000
+
+ArchivedFix = namedtuple("ArchivedFix", "log_id vin timestamp latitude longitude speed")
+FIX_COLUMNS = ArchivedFix._fields
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("log_id", pa.int64()),
+        ("vin", pa.dictionary(pa.int32(), pa.string())),
+        ("timestamp", pa.timestamp("us")),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("speed", pa.float64()),
+    ])
+
+
+def _relative_path(trip):
+    month = (trip.start_time or trip.end_time).strftime("%Y-%m")
+    vin = trip.vin.replace("/", "_")
+    return os.path.join(f"month={month}", f"vin={vin}", f"trip_{trip.trip_id}.parquet")
+
+
+def archive_trip(db, trip):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    relative_path = _relative_path(trip)
+    path = os.path.join(ARCHIVE_DIR, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    query = db.query(*(getattr(LocationLog, c) for c in FIX_COLUMNS))\
+        .filter(LocationLog.trip_id == trip.trip_id)\
+        .order_by(LocationLog.timestamp, LocationLog.log_id)\
+        .yield_per(ROW_GROUP_SIZE)
+
+    schema = _schema()
+    rows = 0
+    with pq.ParquetWriter(path + ".tmp", schema, compression="zstd") as writer:
+        batch = []
+        for row in query:
+            batch.append(row)
+            if len(batch) == ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist([row._asdict() for row in batch], schema=schema))
+                rows += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist([row._asdict() for row in batch], schema=schema))
+            rows += len(batch)
+    os.replace(path + ".tmp", path)
+
+    # The truck's newest fix stays hot: /trip/start and stop events read it.
+    newest = db.query(func.max(LocationLog.log_id)).filter(LocationLog.vin == trip.vin).scalar_subquery()
+    db.query(LocationLog)\
+        .filter(LocationLog.trip_id == trip.trip_id, LocationLog.log_id != newest)\
+        .delete(synchronize_session=False)
+    trip.archive_path = relative_path
+    db.commit()
+    return rows
+
+
+def archive_completed_trips(older_than_days=ARCHIVE_AFTER_DAYS, limit=None):
+    cutoff = datetime.now().astimezone() - timedelta(days=older_than_days)
+    db = SessionLocal()
+    try:
+        query = db.query(Trip)\
+            .filter(Trip.status == "completed", Trip.end_time < cutoff, Trip.archive_path.is_(None))\
+            .order_by(Trip.end_time)
+        if limit:
+            query = query.limit(limit)
+        archived = {}
+        for trip in query.all():
+            archived[trip.trip_id] = archive_trip(db, trip)
+        return archived
+    finally:
+        db.close()
+
+
+@lru_cache(maxsize=64)
+def _metadata(relative_path):
+    # Archive files are written once (os.replace) and never change, so their
+    # footers can be parsed once per process.
+    import pyarrow.parquet as pq
+    return pq.read_metadata(os.path.join(ARCHIVE_DIR, relative_path))
+
+
+def _read_archived_page(relative_path, cursor, limit):
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    metadata = _metadata(relative_path)
+    parquet = pq.ParquetFile(os.path.join(ARCHIVE_DIR, relative_path), metadata=metadata)
+    ts_column = parquet.schema_arrow.get_field_index("timestamp")
+    page = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(ts_column).statistics
+        if cursor is not None and stats is not None and stats.has_min_max and stats.max < cursor[0]:
+            continue
+        # Filter and slice in Arrow; only the rows of the page become Python objects.
+        table = parquet.read_row_group(i, columns=list(FIX_COLUMNS))
+        if cursor is not None:
+            ts, log_id = cursor
+            table = table.filter(pc.or_(
+                pc.greater(table["timestamp"], ts),
+                pc.and_(pc.equal(table["timestamp"], ts), pc.greater(table["log_id"], log_id))
+            ))
+        page.extend(ArchivedFix(**row) for row in table.slice(0, limit - len(page)).to_pylist())
+        if len(page) == limit:
+            return page
+    return page
+
+
+def fetch_trip_points(db, trip_id, archive_path, cursor, limit):
+    # One page of a trip's fixes in (timestamp, log_id) order after cursor,
+    # from whichever tier holds the trip.
+    if archive_path:
+        return _read_archived_page(archive_path, cursor, limit)
+
+    query = db.query(*(getattr(LocationLog, c) for c in FIX_COLUMNS))\
+        .filter(LocationLog.trip_id == trip_id)
+    if cursor is not None:
+        query = query.filter(tuple_(LocationLog.timestamp, LocationLog.log_id) > tuple_(*cursor))
+    return query.order_by(LocationLog.timestamp, LocationLog.log_id).limit(limit).all()
+
+
+if __name__ == "__main__":
+    from app.logging_setup import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Move fixes of old completed trips to Parquet files.")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--limit", type=int, help="archive at most this many trips")
+    args = parser.parse_args()
+    setup_logging()
+    try:
+        for trip_id, rows in archive_completed_trips(args.older_than_days, args.limit).items():
+            logger.info("archived trip", extra={"trip_id": trip_id, "fixes": rows})
+    finally:
+        stop_logging()
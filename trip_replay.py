@@ -0,0 +1,175 @@
+import asyncio
+import json
+from datetime import datetime
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app import rate_limit
+from app.database import SessionLocal
+from app.models import Trip
+from app.trip_archive import fetch_trip_points
+from app.websocket_utils import location_message
+
+router = APIRouter()
+
+REPLAY_PAGE_SIZE = 500
+MIN_SPEED, MAX_SPEED = 1.0, 1000.0
+# Gaps in the recording (truck parked, phone offline) are not replayed in full.
+MAX_GAP_SECONDS = 5.0
+# Fixes closer together than this (after speed-up) are sent without sleeping in between.
+MIN_SLEEP_SECONDS = 0.05
+MAX_CONCURRENT_REPLAYS = 20
+replay_slots = asyncio.Semaphore(MAX_CONCURRENT_REPLAYS)
+
+
+class ReplayControl:
+    def __init__(self, speed):
+        self.speed = speed
+        self.paused = False
+        self.seek_to = None
+        self.closed = False
+        self.changed = asyncio.Event()
+
+    async def wait(self, timeout=None):
+        # True when a command arrived before the timeout ran out.
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.changed.clear()
+
+    def state(self, trip_id):
+        return {"type": "replay_state", "trip_id": trip_id, "speed": self.speed, "paused": self.paused}
+
+
+def _clamp_speed(value):
+    return max(MIN_SPEED, min(MAX_SPEED, float(value)))
+
+
+def _load_trip(trip_id):
+    db = SessionLocal()
+    try:
+        return db.query(Trip.trip_id, Trip.archive_path).filter_by(trip_id=trip_id).first()
+    finally:
+        db.close()
+
+
+def _fetch_page(trip_id, archive_path, cursor, limit):
+    # Keyset pagination on (timestamp, log_id) so every page, and every seek,
+    # is a range scan (ix_location_log_trip_time, or row-group statistics for
+    # archived trips) rather than an OFFSET.
+    db = SessionLocal()
+    try:
+        return fetch_trip_points(db, trip_id, archive_path, cursor, limit)
+    finally:
+        db.close()
+
+
+async def _read_commands(websocket: WebSocket, trip_id, control: ReplayControl):
+    try:
+        while True:
+            try:
+                command = json.loads(await websocket.receive_text())
+                if not isinstance(command, dict):
+                    raise ValueError("Command must be a JSON object")
+                action = command.get("action")
+                if action == "pause":
+                    control.paused = True
+                elif action == "resume":
+                    control.paused = False
+                elif action == "speed":
+                    control.speed = _clamp_speed(command["speed"])
+                elif action == "seek":
+                    seek_to = datetime.fromisoformat(command["to"])
+                    # Fixes are stored as naive local time.
+                    control.seek_to = seek_to.astimezone().replace(tzinfo=None) if seek_to.tzinfo else seek_to
+                else:
+                    raise ValueError(f"Unknown action: {action}")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                await websocket.send_text(json.dumps({"type": "replay_error", "error": str(e)}))
+                continue
+            control.changed.set()
+            await websocket.send_text(json.dumps(control.state(trip_id)))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Whatever ends the reader also ends the stream, otherwise a paused or
+        # finished replay would wait forever and keep its slot.
+        control.closed = True
+        control.changed.set()
+
+
+async def _stream(websocket: WebSocket, trip_id, archive_path, control: ReplayControl):
+    cursor = None
+    prev_ts = None
+    owed = 0.0
+    await websocket.send_text(json.dumps(control.state(trip_id)))
+
+    while not control.closed:
+        if control.seek_to is not None:
+            cursor, prev_ts, owed = (control.seek_to, -1), None, 0.0
+            control.seek_to = None
+
+        page = await asyncio.to_thread(_fetch_page, trip_id, archive_path, cursor, REPLAY_PAGE_SIZE)
+        if not page:
+            await websocket.send_text(json.dumps({"type": "replay_end", "trip_id": trip_id}))
+            # Stay open so the client can seek back.
+            await control.wait()
+            continue
+
+        for row in page:
+            while control.paused and not control.closed and control.seek_to is None:
+                await control.wait()
+            if control.closed or control.seek_to is not None:
+                break
+
+            if prev_ts is not None and row.timestamp is not None:
+                gap = min((row.timestamp - prev_ts).total_seconds(), MAX_GAP_SECONDS * control.speed)
+                owed += max(gap, 0) / control.speed
+            if owed >= MIN_SLEEP_SECONDS:
+                if await control.wait(owed):
+                    # Paused, sought or re-speeded: re-read from the cursor.
+                    owed = 0.0
+                    break
+                owed = 0.0
+
+            await websocket.send_text(json.dumps(
+                location_message(row.vin, row.latitude, row.longitude, row.timestamp, row.speed)
+            ))
+            prev_ts = row.timestamp
+            cursor = (row.timestamp, row.log_id)
+
+
+@router.websocket("/ws/replay/{trip_id}")
+async def replay_ws(websocket: WebSocket, trip_id: int):
+    try:
+        speed = _clamp_speed(websocket.query_params.get("speed", 1))
+    except ValueError:
+        await websocket.close(code=1003)
+        return
+
+    client = websocket.scope.get("client")
+    if not rate_limit.allow_websocket(client[0] if client else "unknown", "/ws/replay/{trip_id}"):
+        await websocket.close(code=1013)
+        return
+
+    if replay_slots.locked():
+        # Try again later: live fan-out has priority over replays.
+        await websocket.close(code=1013)
+        return
+
+    async with replay_slots:
+        trip = await asyncio.to_thread(_load_trip, trip_id)
+        if not trip:
+            await websocket.close(code=1008)
+            return
+
+        await websocket.accept()
+        control = ReplayControl(speed)
+        reader = asyncio.create_task(_read_commands(websocket, trip_id, control))
+        try:
+            await _stream(websocket, trip_id, trip.archive_path, control)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            reader.cancel()
@@ -1,23 +1,26 @@
 from fastapi import APIRouter, Request 
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from geoalchemy2.shape import from_shape
-from geoalchemy2.shape import to_shape 
-from shapely.geometry import Point
-from datetime import datetime, timezone
-import openrouteservice
-from app.models import TripPlan, Trip,Truck, Driver,TruckStats, TripComparison, StopEvent, StopEventType
-from fastapi import Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from typing import List, Optional
+import hashlib
+import json
+from app.models import TripPlan, Trip,Truck, Driver,TruckStats, TripComparison, StopEvent, StopEventType, IdempotencyKey, TruckRollup
+from fastapi import Depends, Header, HTTPException
 from app.database import get_db
 from app.models import Trip, LocationLog
 from app.database import SessionLocal
-from app.location_search import geocode_place
+from app.location_search import geocode_place, get_ors_client, route_coordinates
+from app.geo_utils import make_point, make_linestring, to_shape, path_distance_km
 from pydantic import BaseModel
 from app.websocket_utils import broadcast_location_sync
+from app.rollups import BUCKETS, bucket_start
+from app.trip_archive import fetch_trip_points
 
 
 router = APIRouter()
-ORS = openrouteservice.Client(key="5b3ce3597851110001cf6248e1d8e314ca754bc68acfb5b1aaa27ca5")
 
 @router.post("/trip/start")
 async def start_trip(request: Request):
@@ -35,7 +38,7 @@ async def start_trip(request: Request):
         if not latest_location:
             return {"error": "No location data found for this truck."}
 
-        origin_point = from_shape(Point(latest_location.longitude, latest_location.latitude), srid=4326)
+        origin_point = make_point(latest_location.longitude, latest_location.latitude)
 
         trip = Trip(
             vin=vin,
@@ -68,6 +71,154 @@ async def start_trip(request: Request):
         db.close()
 
 
+def _complete_trip(db, trip, trip_logs, fuel_consumed, plan, existing_comparison, stats):
+    first_log, last_log = trip_logs[0], trip_logs[-1]
+    lat1, lon1 = first_log.latitude, first_log.longitude
+    lat2, lon2 = last_log.latitude, last_log.longitude
+
+    origin_point = make_point(lon1, lat1)
+    destination_point = make_point(lon2, lat2)
+
+    actual_distance_km = path_distance_km(trip_logs)
+
+    trip.start_lat, trip.start_lon = lat1, lon1
+    trip.end_lat, trip.end_lon = lat2, lon2
+    trip.origin, trip.destination = origin_point, destination_point
+    trip.end_time = datetime.now(timezone.utc)
+    trip.status = "completed"
+    trip.distance_km = round(actual_distance_km, 2)
+    trip.fuel_consumed_litres = fuel_consumed if fuel_consumed else None
+
+    duration_minutes = None
+    if trip.start_time and trip.end_time:
+        duration = trip.end_time - trip.start_time
+        duration_minutes = duration.total_seconds() / 60
+
+    comparison = None
+    efficiency = None
+    actual_avg_speed = 0
+
+    if plan and duration_minutes:
+        actual_avg_speed = actual_distance_km / (duration_minutes / 60)
+        efficiency = round((plan.expected_time_minutes / duration_minutes) * 100, 2) if duration_minutes else 0
+        comparison = {
+            "expected_distance_km": plan.expected_distance_km,
+            "actual_distance_km": round(actual_distance_km, 2),
+            "expected_time_minutes": plan.expected_time_minutes,
+            "actual_time_minutes": duration_minutes,
+            "expected_avg_speed": plan.expected_avg_speed,
+            "actual_avg_speed": round(actual_avg_speed, 1),
+            "efficiency_percent": efficiency
+        }
+
+        if existing_comparison:
+            existing_comparison.expected_distance_km = comparison["expected_distance_km"]
+            existing_comparison.actual_distance_km = comparison["actual_distance_km"]
+            existing_comparison.expected_time_minutes = comparison["expected_time_minutes"]
+            existing_comparison.actual_time_minutes = comparison["actual_time_minutes"]
+            existing_comparison.expected_avg_speed = comparison["expected_avg_speed"]
+            existing_comparison.actual_avg_speed = comparison["actual_avg_speed"]
+            existing_comparison.efficiency_percent = efficiency
+        else:
+            comp = TripComparison(
+                trip_id=trip.trip_id,
+                expected_distance_km=comparison["expected_distance_km"],
+                actual_distance_km=comparison["actual_distance_km"],
+                expected_time_minutes=comparison["expected_time_minutes"],
+                actual_time_minutes=comparison["actual_time_minutes"],
+                expected_avg_speed=comparison["expected_avg_speed"],
+                actual_avg_speed=comparison["actual_avg_speed"],
+                efficiency_percent=efficiency
+            )
+            db.add(comp)
+
+    # ✅ Update truck stats
+    if duration_minutes:
+        if not stats:
+            stats = TruckStats(
+                vin=trip.vin,
+                total_trips=1,
+                total_distance_km=actual_distance_km,
+                total_duration_minutes=duration_minutes,
+                average_distance_per_trip_km=actual_distance_km,
+                average_speed_kmph=actual_avg_speed,
+                last_updated=datetime.utcnow()
+            )
+            db.add(stats)
+        else:
+            stats.total_trips += 1
+            stats.total_distance_km += actual_distance_km
+            stats.total_duration_minutes += duration_minutes
+            stats.average_distance_per_trip_km = stats.total_distance_km / stats.total_trips
+            stats.average_speed_kmph = stats.total_distance_km / (stats.total_duration_minutes / 60) if stats.total_duration_minutes > 0 else 0
+            stats.last_updated = datetime.utcnow()
+
+    result = {
+        "message": "Trip ended successfully.",
+        "trip_id": trip.trip_id,
+        "start_time": trip.start_time.isoformat() if trip.start_time else None,
+        "end_time": trip.end_time.isoformat(),
+        "start_lat": lat1,
+        "start_lon": lon1,
+        "end_lat": lat2,
+        "end_lon": lon2,
+        "duration_minutes": duration_minutes,
+        "total_distance_km": round(actual_distance_km, 2),
+        "comparison": comparison
+    }
+    return result, stats
+
+
+def _fuel_totals(db, vins):
+    # Running [km, litres] per truck over its completed trips with a fuel figure.
+    rows = db.query(
+        Trip.vin, func.sum(Trip.distance_km), func.sum(Trip.fuel_consumed_litres)
+    ).filter(
+        Trip.vin.in_(list(vins)),
+        Trip.status == "completed",
+        Trip.fuel_consumed_litres.isnot(None)
+    ).group_by(Trip.vin)
+    return {vin: [km or 0.0, litres or 0.0] for vin, km, litres in rows}
+
+
+def _add_fuel(totals, trip):
+    # Counts a just-completed trip into totals. True when the truck's
+    # efficiency should be recomputed.
+    if not trip.fuel_consumed_litres:
+        return False
+    running = totals.setdefault(trip.vin, [0.0, 0.0])
+    running[0] += trip.distance_km or 0.0
+    running[1] += trip.fuel_consumed_litres
+    return bool(trip.distance_km)
+
+
+def _update_fuel_efficiency(db, totals, vins):
+    mappings = [
+        {"vin": vin, "fuel_efficiency_kmpl": round(totals[vin][0] / totals[vin][1], 2)}
+        for vin in vins if totals[vin][1]
+    ]
+    if mappings:
+        db.bulk_update_mappings(Truck, mappings)
+
+
+def _request_hash(body):
+    return hashlib.sha256(json.dumps(body.dict(), sort_keys=True).encode()).hexdigest()
+
+
+def _trip_ended_event(trip, result, driver_id):
+    return {
+        "type": "trip_ended",
+        "vin": trip.vin,
+        "driver_id": driver_id,
+        "trip_id": trip.trip_id,
+        "start_time": result["start_time"],
+        "end_time": result["end_time"],
+        "distance_km": result["total_distance_km"],
+        "duration_minutes": result["duration_minutes"],
+        "comparison": result["comparison"]
+    }
+
+
 @router.post("/trip/end")
 async def end_trip(request: Request):
     data = await request.json()
@@ -83,156 +234,199 @@ async def end_trip(request: Request):
         if not trip_logs:
             return {"error": "No location logs found for this trip."}
 
-        first_log, last_log = trip_logs[0], trip_logs[-1]
-        lat1, lon1 = first_log.latitude, first_log.longitude
-        lat2, lon2 = last_log.latitude, last_log.longitude
-
-        origin_point = from_shape(Point(lon1, lat1), srid=4326)
-        destination_point = from_shape(Point(lon2, lat2), srid=4326)
-
-        from math import radians, cos, sin, sqrt, atan2
-        def haversine(lat1, lon1, lat2, lon2):
-            R = 6371
-            dlat = radians(lat2 - lat1)
-            dlon = radians(lon2 - lon1)
-            a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-            c = 2 * atan2(sqrt(a), sqrt(1 - a))
-            return R * c
-
-        actual_distance_km = sum(
-            haversine(trip_logs[i - 1].latitude, trip_logs[i - 1].longitude, trip_logs[i].latitude, trip_logs[i].longitude)
-            for i in range(1, len(trip_logs))
-        )
+        fuel_consumed = float(data.get("fuel_consumed_litres")) if data.get("fuel_consumed_litres") else None
+        plan = db.query(TripPlan).filter_by(plan_id=trip.plan_id).first() if trip.plan_id else None
+        existing = db.query(TripComparison).filter_by(trip_id=trip.trip_id).first() if plan else None
+        stats = db.query(TruckStats).filter(TruckStats.vin == trip.vin).first()
+
+        # Before _complete_trip, while the trip is still active and not in the sums.
+        fuel_totals = _fuel_totals(db, [trip.vin]) if fuel_consumed else {}
+        result, _ = _complete_trip(db, trip, trip_logs, fuel_consumed, plan, existing, stats)
+        if _add_fuel(fuel_totals, trip):
+            _update_fuel_efficiency(db, fuel_totals, [trip.vin])
+        db.commit()
 
-        trip.start_lat, trip.start_lon = lat1, lon1
-        trip.end_lat, trip.end_lon = lat2, lon2
-        trip.origin, trip.destination = origin_point, destination_point
-        trip.end_time = datetime.now(timezone.utc)
-        trip.status = "completed"
-        trip.distance_km = round(actual_distance_km, 2)
+        driver_id = db.query(Truck.driver_id).filter(Truck.vin == trip.vin).scalar()
+        broadcast_location_sync(_trip_ended_event(trip, result, driver_id))
+        return result
+
+    finally:
+        db.close()
+
+
+MAX_BATCH_SIZE = 500
+
+
+class TripBatchStart(BaseModel):
+    vins: List[str]
+    plan_id: Optional[int] = None
+
+
+class TripBatchEndItem(BaseModel):
+    trip_id: int
+    fuel_consumed_litres: Optional[float] = None
+
+
+class TripBatchEnd(BaseModel):
+    trips: List[TripBatchEndItem]
 
-        fuel_consumed = data.get("fuel_consumed_litres")
-        fuel_consumed = float(data.get("fuel_consumed_litres")) if data.get("fuel_consumed_litres") else None
-        trip.fuel_consumed_litres = fuel_consumed if fuel_consumed else None
-
-        if fuel_consumed and actual_distance_km:
-            trip_efficiency = actual_distance_km / fuel_consumed 
-
-            truck = db.query(Truck).filter(Truck.vin == trip.vin).first()
-            if truck:
-                trips_with_fuel = db.query(Trip).filter(
-                    Trip.vin == trip.vin,
-                    Trip.status == "completed",
-                    Trip.fuel_consumed_litres.isnot(None)
-                ).all()
-
-                total_km = sum(t.distance_km for t in trips_with_fuel)
-                total_fuel = sum(t.fuel_consumed_litres for t in trips_with_fuel)
-
-                if total_fuel > 0:
-                    truck.fuel_efficiency_kmpl = round(total_km / total_fuel, 2)
-                    db.add(truck)
-
-
-        duration_minutes = None
-        if trip.start_time and trip.end_time:
-            duration = trip.end_time - trip.start_time
-            duration_minutes = duration.total_seconds() / 60
-
-        comparison = None
-        efficiency = None
-        actual_avg_speed = 0
-
-        if trip.plan_id:
-            plan = db.query(TripPlan).filter_by(plan_id=trip.plan_id).first()
-            if plan and duration_minutes:
-                actual_avg_speed = actual_distance_km / (duration_minutes / 60)
-                efficiency = round((plan.expected_time_minutes / duration_minutes) * 100, 2) if duration_minutes else 0
-                comparison = {
-                    "expected_distance_km": plan.expected_distance_km,
-                    "actual_distance_km": round(actual_distance_km, 2),
-                    "expected_time_minutes": plan.expected_time_minutes,
-                    "actual_time_minutes": duration_minutes,
-                    "expected_avg_speed": plan.expected_avg_speed,
-                    "actual_avg_speed": round(actual_avg_speed, 1),
-                    "efficiency_percent": efficiency
-                }
-
-                existing = db.query(TripComparison).filter_by(trip_id=trip.trip_id).first()
-                if existing:
-                    existing.expected_distance_km = comparison["expected_distance_km"]
-                    existing.actual_distance_km = comparison["actual_distance_km"]
-                    existing.expected_time_minutes = comparison["expected_time_minutes"]
-                    existing.actual_time_minutes = comparison["actual_time_minutes"]
-                    existing.expected_avg_speed = comparison["expected_avg_speed"]
-                    existing.actual_avg_speed = comparison["actual_avg_speed"]
-                    existing.efficiency_percent = efficiency
-                else:
-                    comp = TripComparison(
-                        trip_id=trip.trip_id,
-                        expected_distance_km=comparison["expected_distance_km"],
-                        actual_distance_km=comparison["actual_distance_km"],
-                        expected_time_minutes=comparison["expected_time_minutes"],
-                        actual_time_minutes=comparison["actual_time_minutes"],
-                        expected_avg_speed=comparison["expected_avg_speed"],
-                        actual_avg_speed=comparison["actual_avg_speed"],
-                        efficiency_percent=efficiency
-                    )
-                    db.add(comp)
-
-        # ✅ Update truck stats
-        if duration_minutes:
-            stats = db.query(TruckStats).filter(TruckStats.vin == trip.vin).first()
-            if not stats:
-                stats = TruckStats(
-                    vin=trip.vin,
-                    total_trips=1,
-                    total_distance_km=actual_distance_km,
-                    total_duration_minutes=duration_minutes,
-                    average_distance_per_trip_km=actual_distance_km,
-                    average_speed_kmph=actual_avg_speed,
-                    last_updated=datetime.utcnow()
-                )
-                db.add(stats)
-            else:
-                stats.total_trips += 1
-                stats.total_distance_km += actual_distance_km
-                stats.total_duration_minutes += duration_minutes
-                stats.average_distance_per_trip_km = stats.total_distance_km / stats.total_trips
-                stats.average_speed_kmph = stats.total_distance_km / (stats.total_duration_minutes / 60) if stats.total_duration_minutes > 0 else 0
-                stats.last_updated = datetime.utcnow()
 
+def _idempotent_replay(db, key, endpoint, request_hash):
+    if not key:
+        return None
+    stored = db.query(IdempotencyKey).filter_by(key=key).first()
+    if not stored:
+        return None
+    if stored.endpoint != endpoint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for another endpoint.")
+    if stored.request_hash != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body.")
+    return json.loads(stored.response)
 
+
+def _commit_idempotent(db, key, endpoint, request_hash, response):
+    # Returns (response, committed). A concurrent retry with the same key loses
+    # the insert race and gets the winner's stored response instead.
+    if key:
+        db.add(IdempotencyKey(key=key, endpoint=endpoint, request_hash=request_hash, response=json.dumps(response)))
+    try:
         db.commit()
+    except IntegrityError:
+        db.rollback()
+        replay = _idempotent_replay(db, key, endpoint, request_hash)
+        if replay is None:
+            raise
+        return replay, False
+    return response, True
+
+
+@router.post("/trips/start:batch")
+def start_trips_batch(body: TripBatchStart, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    vins = list(dict.fromkeys(body.vins))
+    if len(vins) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} VINs per batch.")
+
+    request_hash = _request_hash(body)
+    replay = _idempotent_replay(db, idempotency_key, "trips/start:batch", request_hash)
+    if replay is not None:
+        return replay
+
+    active = {
+        t.vin: t.trip_id
+        for t in db.query(Trip.vin, Trip.trip_id).filter(Trip.vin.in_(vins), Trip.status == "active")
+    }
+    latest = {
+        log.vin: log
+        for log in db.query(LocationLog)
+            .filter(LocationLog.vin.in_([v for v in vins if v not in active]))
+            .distinct(LocationLog.vin)
+            .order_by(LocationLog.vin, LocationLog.timestamp.desc())
+    }
 
-        broadcast_location_sync({
-            "type": "trip_ended",
-            "vin": trip.vin,
-            "trip_id": trip.trip_id,
-            "start_time": trip.start_time.isoformat() if trip.start_time else None,
-            "end_time": trip.end_time.isoformat(),
-            "distance_km": round(actual_distance_km, 2),
-            "duration_minutes": duration_minutes,
-            "comparison": comparison
-        })
+    now = datetime.now(timezone.utc)
+    started = {}
+    for vin, log in latest.items():
+        started[vin] = Trip(
+            vin=vin,
+            start_time=now,
+            origin=make_point(log.longitude, log.latitude),
+            start_lat=log.latitude,
+            start_lon=log.longitude,
+            plan_id=body.plan_id,
+            status="active"
+        )
+    db.add_all(started.values())
+    db.flush()
+    for vin, trip in started.items():
+        latest[vin].trip_id = trip.trip_id
+
+    results = []
+    for vin in vins:
+        if vin in active:
+            results.append({"vin": vin, "status": "already_active", "trip_id": active[vin]})
+        elif vin in started:
+            results.append({"vin": vin, "status": "started", "trip_id": started[vin].trip_id})
+        else:
+            results.append({"vin": vin, "status": "error", "error": "No location data found for this truck."})
+
+    response, committed = _commit_idempotent(db, idempotency_key, "trips/start:batch", request_hash, {"results": results})
+    if committed:
+        for vin, trip in started.items():
+            broadcast_location_sync({
+                "type": "trip_started",
+                "vin": vin,
+                "trip_id": trip.trip_id,
+                "start_time": trip.start_time.isoformat(),
+                "lat": trip.start_lat,
+                "lon": trip.start_lon
+            })
+    return response
+
+
+@router.post("/trips/end:batch")
+def end_trips_batch(body: TripBatchEnd, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    fuel_by_trip = {item.trip_id: item.fuel_consumed_litres for item in body.trips}
+    if len(fuel_by_trip) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} trips per batch.")
+
+    request_hash = _request_hash(body)
+    replay = _idempotent_replay(db, idempotency_key, "trips/end:batch", request_hash)
+    if replay is not None:
+        return replay
+
+    trips = {
+        t.trip_id: t
+        for t in db.query(Trip).filter(Trip.trip_id.in_(list(fuel_by_trip)), Trip.status == "active")
+    }
+    logs_by_trip = {
+        trip_id: list(rows)
+        for trip_id, rows in groupby(
+            db.query(LocationLog.trip_id, LocationLog.latitude, LocationLog.longitude)
+                .filter(LocationLog.trip_id.in_(list(trips)))
+                .order_by(LocationLog.trip_id, LocationLog.timestamp),
+            key=lambda row: row.trip_id
+        )
+    }
+    plan_ids = {t.plan_id for t in trips.values() if t.plan_id}
+    plans = {p.plan_id: p for p in db.query(TripPlan).filter(TripPlan.plan_id.in_(list(plan_ids)))} if plan_ids else {}
+    comparisons = {c.trip_id: c for c in db.query(TripComparison).filter(TripComparison.trip_id.in_(list(trips)))}
+    vins = {t.vin for t in trips.values()}
+    stats_by_vin = {s.vin: s for s in db.query(TruckStats).filter(TruckStats.vin.in_(list(vins)))}
+    # One grouped query for the batch's trucks; the batch's own trips are
+    # still active here and are added as they complete.
+    fuel_vins = {trips[t].vin for t, fuel in fuel_by_trip.items() if fuel and t in trips}
+    fuel_totals = _fuel_totals(db, fuel_vins) if fuel_vins else {}
+    refuelled = set()
+
+    results, ended = [], []
+    for trip_id, fuel_consumed in fuel_by_trip.items():
+        trip = trips.get(trip_id)
+        if not trip:
+            results.append({"trip_id": trip_id, "status": "error", "error": "Trip not found or already ended."})
+            continue
+        trip_logs = logs_by_trip.get(trip_id)
+        if not trip_logs:
+            results.append({"trip_id": trip_id, "status": "error", "error": "No location logs found for this trip."})
+            continue
+
+        result, stats_by_vin[trip.vin] = _complete_trip(
+            db, trip, trip_logs, fuel_consumed, plans.get(trip.plan_id),
+            comparisons.get(trip_id), stats_by_vin.get(trip.vin)
+        )
+        if _add_fuel(fuel_totals, trip):
+            refuelled.add(trip.vin)
+        results.append({**result, "status": "completed"})
+        ended.append((trip, result))
+    _update_fuel_efficiency(db, fuel_totals, refuelled)
+
+    response, committed = _commit_idempotent(db, idempotency_key, "trips/end:batch", request_hash, {"results": results})
+    if committed and ended:
+        drivers = dict(db.query(Truck.vin, Truck.driver_id).filter(Truck.vin.in_(list({trip.vin for trip, _ in ended}))))
+        for trip, result in ended:
+            broadcast_location_sync(_trip_ended_event(trip, result, drivers.get(trip.vin)))
+    return response
 
-        return {
-            "message": "Trip ended successfully.",
-            "trip_id": trip.trip_id,
-            "start_time": trip.start_time.isoformat() if trip.start_time else None,
-            "end_time": trip.end_time.isoformat(),
-            "start_lat": lat1,
-            "start_lon": lon1,
-            "end_lat": lat2,
-            "end_lon": lon2,
-            "duration_minutes": duration_minutes,
-            "total_distance_km": round(actual_distance_km, 2),
-            "comparison": comparison
-        }
 
-    finally:
-        db.close()
-        
 @router.post("/trip/plan")
 async def plan_trip(request: Request):
     data = await request.json()
@@ -246,18 +440,20 @@ async def plan_trip(request: Request):
         raise HTTPException(status_code=400, detail=str(e))
 
     coords = ((start_lon, start_lat), (end_lon, end_lat))
-    res = ORS.directions(coords, profile="driving-car")
+    res = get_ors_client().directions(coords, profile="driving-car")
     summary = res["routes"][0]["summary"]
+    route_coords = route_coordinates(res)
     dist_km = summary["distance"] / 1000
     time_min = summary["duration"] / 60
     avg_speed = dist_km / (time_min / 60) if time_min else 0
 
     plan = TripPlan(
-        start_point=from_shape(Point(start_lon, start_lat), srid=4326),
-        end_point=from_shape(Point(end_lon, end_lat), srid=4326),
+        start_point=make_point(start_lon, start_lat),
+        end_point=make_point(end_lon, end_lat),
         expected_distance_km=round(dist_km, 2),
         expected_time_minutes=round(time_min, 1),
-        expected_avg_speed=round(avg_speed, 1)
+        expected_avg_speed=round(avg_speed, 1),
+        route=make_linestring(route_coords) if len(route_coords) >= 2 else None
     )
     db = SessionLocal()
     db.add(plan); db.commit(); db.refresh(plan); db.close()
@@ -481,6 +677,118 @@ def truck_efficiency_leaderboard():
     finally:
         db.close()
 
+MAX_POINTS_PAGE = 5000
+
+
+@router.get("/trip/{trip_id}/points")
+def trip_points(trip_id: int, after: Optional[datetime] = None, after_id: int = -1, limit: int = 1000, db: Session = Depends(get_db)):
+    trip = db.query(Trip.trip_id, Trip.archive_path).filter_by(trip_id=trip_id).first()
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+
+    limit = max(1, min(limit, MAX_POINTS_PAGE))
+    if after and after.tzinfo:
+        after = after.astimezone().replace(tzinfo=None)
+    cursor = (after, after_id) if after else None
+    points = fetch_trip_points(db, trip_id, trip.archive_path, cursor, limit)
+
+    last = points[-1] if len(points) == limit else None
+    return {
+        "trip_id": trip_id,
+        "tier": "archive" if trip.archive_path else "hot",
+        "points": [
+            {
+                "log_id": p.log_id,
+                "timestamp": p.timestamp,
+                "lat": p.latitude,
+                "lon": p.longitude,
+                "speed": p.speed
+            }
+            for p in points
+        ],
+        "next": {"after": last.timestamp, "after_id": last.log_id} if last else None
+    }
+
+
+TIMESERIES_WINDOWS = {"1m": timedelta(hours=3), "1h": timedelta(days=2), "1d": timedelta(days=90)}
+
+
+def _timeseries_range(bucket, start, end):
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {list(BUCKETS)}")
+    # Fixes and rollups are stored as naive local time.
+    start, end = (t.astimezone().replace(tzinfo=None) if t and t.tzinfo else t for t in (start, end))
+    end = end or datetime.now()
+    start = start or end - TIMESERIES_WINDOWS[bucket]
+    return start, end
+
+
+@router.get("/truck/{vin}/timeseries")
+def truck_timeseries(vin: str, bucket: str = "1h", start: Optional[datetime] = None, end: Optional[datetime] = None, db: Session = Depends(get_db)):
+    start, end = _timeseries_range(bucket, start, end)
+    rows = db.query(TruckRollup).filter(
+        TruckRollup.vin == vin,
+        TruckRollup.bucket == bucket,
+        TruckRollup.bucket_start >= bucket_start(start, BUCKETS[bucket]),
+        TruckRollup.bucket_start <= end
+    ).order_by(TruckRollup.bucket_start).all()
+
+    return {
+        "vin": vin,
+        "bucket": bucket,
+        "points": [
+            {
+                "bucket_start": r.bucket_start,
+                "distance_km": round(r.distance_km, 3),
+                "moving_minutes": round(r.moving_seconds / 60, 2),
+                "max_speed_kmph": r.max_speed,
+                "avg_speed_kmph": round(r.speed_sum / r.fix_count, 1) if r.fix_count else 0,
+                "fix_count": r.fix_count
+            }
+            for r in rows
+        ]
+    }
+
+
+@router.get("/fleet/timeseries")
+def fleet_timeseries(bucket: str = "1h", start: Optional[datetime] = None, end: Optional[datetime] = None, db: Session = Depends(get_db)):
+    start, end = _timeseries_range(bucket, start, end)
+    rows = (
+        db.query(
+            TruckRollup.bucket_start,
+            func.count(TruckRollup.vin).label("active_trucks"),
+            func.count(TruckRollup.vin).filter(TruckRollup.moving_seconds > 0).label("moving_trucks"),
+            func.sum(TruckRollup.distance_km).label("distance_km"),
+            func.max(TruckRollup.max_speed).label("max_speed"),
+            func.sum(TruckRollup.speed_sum).label("speed_sum"),
+            func.sum(TruckRollup.fix_count).label("fix_count")
+        )
+        .filter(
+            TruckRollup.bucket == bucket,
+            TruckRollup.bucket_start >= bucket_start(start, BUCKETS[bucket]),
+            TruckRollup.bucket_start <= end
+        )
+        .group_by(TruckRollup.bucket_start)
+        .order_by(TruckRollup.bucket_start)
+        .all()
+    )
+
+    return {
+        "bucket": bucket,
+        "points": [
+            {
+                "bucket_start": r.bucket_start,
+                "active_trucks": r.active_trucks,
+                "moving_trucks": r.moving_trucks,
+                "distance_km": round(r.distance_km, 3),
+                "max_speed_kmph": r.max_speed,
+                "avg_speed_kmph": round(r.speed_sum / r.fix_count, 1) if r.fix_count else 0,
+                "fix_count": r.fix_count
+            }
+            for r in rows
+        ]
+    }
+
 @router.post("/stop_event/start")
 async def create_stop_event(request: Request):
     data = await request.json()
@@ -504,7 +812,7 @@ async def create_stop_event(request: Request):
         if not last_log:
             return {"error": "No recent location data found."}
 
-        location_point = from_shape(Point(last_log.longitude, last_log.latitude), srid=4326)
+        location_point = make_point(last_log.longitude, last_log.latitude)
 
         if event_type == StopEventType.OTHERS and not reason:
             return {"error": "Reason is required for 'others' event type."}
@@ -1,22 +1,257 @@
 import asyncio
 import json
-from typing import Set
+import logging
+import secrets
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
 from fastapi import WebSocket
+from app.wire_format import FixEncoder
+from app import metrics
+from sqlalchemy import select, true
+from app.models import LocationLog, Trip, Truck
+
+logger = logging.getLogger("fleet.websocket")
 
 active_websockets: Set[WebSocket] = set()
+binary_websockets: Set[WebSocket] = set()
 main_loop = None
 
-async def broadcast_location(data):
-    if not active_websockets:
+# Binary clients get location fixes batched into one frame per tick.
+BINARY_TICK_SECONDS = 0.25
+binary_encoder = FixEncoder()
+pending_fixes: List[dict] = []
+# Each client has its own bounded send queue drained by a writer task, so a
+# slow client only delays itself. Fan-out, snapshots and binary frames are
+# queued synchronously on the event loop, which keeps every client's stream
+# in order without a lock. A client whose queue is full or whose send fails
+# or times out is dropped and reconnects with ?since=.
+CLIENT_QUEUE_MAX = 1000
+SEND_TIMEOUT_SECONDS = 5.0
+
+# Every broadcast event gets a sequence number and is kept for resuming clients.
+# seq restarts with the process, so events and snapshots also carry EPOCH and
+# clients resume with ?since=<epoch>:<seq>.
+EPOCH = secrets.token_hex(4)
+RECENT_EVENTS_MAX = 2000
+recent_events: Deque[dict] = deque(maxlen=RECENT_EVENTS_MAX)
+last_seq = 0
+fleet_state: Dict[str, dict] = {}
+active_trips: Dict[str, int] = {}
+# Called synchronously with every event before it is queued for sending, so
+# in-process state (e.g. the response cache) is updated before the caller returns.
+event_listeners: List[Callable[[dict], None]] = []
+
+
+class ClientChannel:
+    def __init__(self, websocket: WebSocket, encoding):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=CLIENT_QUEUE_MAX)
+        self.task = asyncio.create_task(self._write())
+
+    def send(self, message):
+        # False when the client is too far behind to keep.
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        ws = self.websocket
+        try:
+            while True:
+                message = await self.queue.get()
+                send = ws.send_bytes if isinstance(message, bytes) else ws.send_text
+                await asyncio.wait_for(send(message), SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            drop_client(ws, "timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+
+
+channels: Dict[WebSocket, ClientChannel] = {}
+
+
+def _clients(encoding):
+    return binary_websockets if encoding == "binary" else active_websockets
+
+
+def unregister_client(websocket: WebSocket):
+    channel = channels.pop(websocket, None)
+    if channel is None:
+        return
+    _clients(channel.encoding).discard(websocket)
+    metrics.WEBSOCKET_CLIENTS.set(len(_clients(channel.encoding)), encoding=channel.encoding)
+    if channel.task is not asyncio.current_task():
+        channel.task.cancel()
+
+
+async def _close(websocket: WebSocket):
+    try:
+        await asyncio.wait_for(websocket.close(code=1013), SEND_TIMEOUT_SECONDS)
+    except Exception:
+        pass
+
+
+def drop_client(websocket: WebSocket, reason):
+    channel = channels.get(websocket)
+    if channel is None:
+        return
+    metrics.WEBSOCKET_DROPPED.inc(encoding=channel.encoding, reason=reason)
+    logger.warning("dropping websocket client", extra={"encoding": channel.encoding, "reason": reason})
+    unregister_client(websocket)
+    asyncio.create_task(_close(websocket))
+
+
+def _fan_out(clients, message):
+    for ws in list(clients):
+        if not channels[ws].send(message):
+            drop_client(ws, "behind")
+
+
+def location_message(device, lat, lon, timestamp, speed):
+    return {
+        "device": device,
+        "lat": lat,
+        "lon": lon,
+        "timestamp": timestamp.isoformat(),
+        "speed": speed
+    }
+
+
+def is_location_fix(data):
+    return "type" not in data and "device" in data
+
+
+def record_event(data):
+    global last_seq
+    last_seq += 1
+    event = {**data, "seq": last_seq, "epoch": EPOCH}
+    recent_events.append(event)
+
+    if is_location_fix(event):
+        fleet_state[event["device"]] = event
+    elif event.get("type") == "trip_started":
+        active_trips[event["vin"]] = event["trip_id"]
+    elif event.get("type") == "trip_ended":
+        active_trips.pop(event["vin"], None)
+    return event
+
+
+def snapshot(include_trucks=True):
+    data = {"type": "snapshot", "epoch": EPOCH, "seq": last_seq, "active_trips": active_trips}
+    if include_trucks:
+        data["trucks"] = list(fleet_state.values())
+    return data
+
+
+def events_since(epoch, seq) -> Optional[List[dict]]:
+    # None means the client is from another server run or too far behind to resume.
+    if epoch != EPOCH or seq > last_seq:
+        return None
+    if seq < last_seq and (not recent_events or recent_events[0]["seq"] > seq + 1):
+        return None
+    return [e for e in recent_events if e["seq"] > seq]
+
+
+async def broadcast_location(data, received_at=None):
+    event = record_event(data)
+    if is_location_fix(event):
+        pending_fixes.append(event)
+    targets = active_websockets if is_location_fix(event) else active_websockets | binary_websockets
+    if targets:
+        msg = json.dumps(event)
+        with metrics.WEBSOCKET_SEND_SECONDS.time(encoding="json"):
+            _fan_out(targets, msg)
+    if received_at is not None:
+        metrics.INGEST_SECONDS.observe(time.perf_counter() - received_at, stage="broadcast")
+
+
+def load_seed(db):
+    # fleet_state and active_trips are otherwise only built from this
+    # process's events, so a restarted server would hand out an empty
+    # snapshot. One backwards scan of ix_location_log_vin_time per truck.
+    latest = select(LocationLog.vin, LocationLog.timestamp, LocationLog.latitude, LocationLog.longitude, LocationLog.speed)\
+        .where(LocationLog.vin == Truck.vin)\
+        .order_by(LocationLog.timestamp.desc(), LocationLog.log_id.desc())\
+        .limit(1)\
+        .lateral()
+    fixes = [
+        location_message(row.vin, row.latitude, row.longitude, row.timestamp, row.speed)
+        for row in db.execute(select(latest).select_from(Truck).join(latest, true()))
+        if row.timestamp is not None
+    ]
+    trips = db.query(Trip.vin, Trip.trip_id).filter(Trip.status == "active").all()
+    return fixes, trips
+
+
+def apply_seed(fixes, trips):
+    # Runs on the event loop. Live events recorded while the seed query ran
+    # are newer and win.
+    seeded = []
+    for fix in fixes:
+        if fix["device"] not in fleet_state:
+            fleet_state[fix["device"]] = {**fix, "seq": 0, "epoch": EPOCH}
+            seeded.append(fix)
+    binary_encoder.observe(seeded)
+    for vin, trip_id in trips:
+        active_trips.setdefault(vin, trip_id)
+    return len(seeded), len(active_trips)
+
+
+async def register_client(websocket: WebSocket, binary=False, since=None):
+    # Runs without awaiting, so no event can slip in between the snapshot (or
+    # replay) and the client joining the live fan-out.
+    encoding = "binary" if binary else "json"
+    channel = channels[websocket] = ClientChannel(websocket, encoding)
+    missed = events_since(*since) if since is not None else None
+    if binary:
+        channel.send(binary_encoder.keyframe())
+        # Fixes are covered by the keyframe, only trip/truck events are replayed.
+        missed = [e for e in missed if not is_location_fix(e)] if missed is not None else None
+    if missed is None or len(missed) >= CLIENT_QUEUE_MAX:
+        channel.send(json.dumps(snapshot(include_trucks=not binary)))
+    else:
+        for event in missed:
+            channel.send(json.dumps(event))
+    _clients(encoding).add(websocket)
+    metrics.WEBSOCKET_CLIENTS.set(len(_clients(encoding)), encoding=encoding)
+
+
+async def flush_binary_fixes():
+    if not pending_fixes:
+        return
+    fixes = pending_fixes[:]
+    pending_fixes.clear()
+    if not binary_websockets:
+        binary_encoder.observe(fixes)
         return
-    msg = json.dumps(data)
-    await asyncio.gather(*(ws.send_text(msg) for ws in active_websockets))
+    frame = binary_encoder.encode(fixes)
+    with metrics.WEBSOCKET_SEND_SECONDS.time(encoding="binary"):
+        _fan_out(binary_websockets, frame)
+
+
+async def binary_flush_loop():
+    while True:
+        await asyncio.sleep(BINARY_TICK_SECONDS)
+        try:
+            await flush_binary_fixes()
+        except Exception:
+            logger.exception("binary flush error")
+
 
-def broadcast_location_sync(data):
+def broadcast_location_sync(data, received_at=None):
+    for listener in event_listeners:
+        try:
+            listener(data)
+        except Exception:
+            logger.exception("event listener error", extra={"event_type": data.get("type")})
     try:
         if main_loop and main_loop.is_running():
-            asyncio.run_coroutine_threadsafe(broadcast_location(data), main_loop)
+            asyncio.run_coroutine_threadsafe(broadcast_location(data, received_at), main_loop)
         else:
-            print("⚠️ Main event loop not running")
-    except Exception as e:
-        print(f"Broadcast error: {e}")
+            logger.warning("main event loop not running, dropping broadcast", extra={"event_type": data.get("type")})
+    except Exception:
+        logger.exception("broadcast error")
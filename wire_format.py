@@ -0,0 +1,135 @@
+import struct
+from datetime import datetime
+
+# Binary frame layout for /ws/location?encoding=binary (all little endian):
+#
+#   header   <BBHHII version, kind, vin_count, fix_count, base_ts (epoch s), seq
+#   vins     <HB     vin_id, name length, followed by the utf-8 name
+#   fixes    <HiiIH  vin_id, dlat, dlon (1e-6 deg), dt (s after base_ts), speed (0.1 km/h)
+#
+# A KEYFRAME carries the whole VIN dictionary and absolute coordinates, the
+# client resets its state on it. A DELTA frame only lists VINs the client has
+# not seen yet and coordinates relative to the last fix sent for that VIN.
+# seq is the feed sequence number of the last fix a frame accounts for, so a
+# client can resume with ?since=<epoch>:<seq> (epoch from the JSON snapshot).
+# Trip/truck events are still sent to binary clients as JSON text frames.
+#
+# base_ts is the oldest fix in the frame. dt is 32 bits because a keyframe
+# can hold trucks that have been quiet for days, and OwnTracks flushes
+# buffered old fixes next to fresh ones.
+
+VERSION = 3
+KEYFRAME = 0
+DELTA = 1
+
+HEADER = struct.Struct("<BBHHII")
+VIN = struct.Struct("<HB")
+FIX = struct.Struct("<HiiIH")
+
+COORD_SCALE = 1_000_000
+SPEED_SCALE = 10
+MAX_VINS = 0xFFFF
+
+
+def fix_epoch(fix):
+    ts = fix["timestamp"]
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    return int(ts.timestamp())
+
+
+def _clamp_u16(value):
+    return max(0, min(0xFFFF, int(value)))
+
+
+class FixEncoder:
+    def __init__(self):
+        self.vin_ids = {}
+        # vin_id -> (lat_e6, lon_e6, epoch, speed_e1) of the last fix sent
+        self.last = {}
+        self.seq = 0
+
+    def _vin_id(self, vin, new_vins):
+        vin_id = self.vin_ids.get(vin)
+        if vin_id is None:
+            vin_id = len(self.vin_ids)
+            if vin_id >= MAX_VINS:
+                raise ValueError("VIN dictionary is full")
+            self.vin_ids[vin] = vin_id
+            new_vins.append((vin_id, vin))
+        return vin_id
+
+    def _rows(self, fixes):
+        new_vins, rows = [], []
+        for fix in fixes:
+            vin_id = self._vin_id(fix["device"], new_vins)
+            lat = round(fix["lat"] * COORD_SCALE)
+            lon = round(fix["lon"] * COORD_SCALE)
+            speed = _clamp_u16((fix.get("speed") or 0) * SPEED_SCALE)
+            prev = self.last.get(vin_id)
+            plat, plon = (prev[0], prev[1]) if prev else (0, 0)
+            epoch = fix_epoch(fix)
+            rows.append((vin_id, lat - plat, lon - plon, epoch, speed))
+            self.last[vin_id] = (lat, lon, epoch, speed)
+            self.seq = max(self.seq, fix.get("seq", 0))
+        return new_vins, rows
+
+    def observe(self, fixes):
+        self._rows(fixes)
+
+    def encode(self, fixes):
+        new_vins, rows = self._rows(fixes)
+        return _pack(DELTA, new_vins, rows, self.seq)
+
+    def keyframe(self):
+        names = {vin_id: vin for vin, vin_id in self.vin_ids.items()}
+        rows = [
+            (vin_id, lat, lon, epoch, speed)
+            for vin_id, (lat, lon, epoch, speed) in self.last.items()
+        ]
+        return _pack(KEYFRAME, sorted(names.items()), rows, self.seq)
+
+
+def _pack(kind, new_vins, rows, seq):
+    base_ts = min((row[3] for row in rows), default=0)
+    parts = [HEADER.pack(VERSION, kind, len(new_vins), len(rows), base_ts, seq)]
+    for vin_id, vin in new_vins:
+        name = vin.encode()[:255]
+        parts.append(VIN.pack(vin_id, len(name)))
+        parts.append(name)
+    for vin_id, dlat, dlon, epoch, speed in rows:
+        parts.append(FIX.pack(vin_id, dlat, dlon, epoch - base_ts, speed))
+    return b"".join(parts)
+
+
+def decode_frame(frame, state):
+    version, kind, vin_count, fix_count, base_ts, seq = HEADER.unpack_from(frame, 0)
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    if kind == KEYFRAME:
+        state["vins"], state["last"] = {}, {}
+    vins, last = state.setdefault("vins", {}), state.setdefault("last", {})
+    state["seq"] = seq
+
+    offset = HEADER.size
+    for _ in range(vin_count):
+        vin_id, length = VIN.unpack_from(frame, offset)
+        offset += VIN.size
+        vins[vin_id] = frame[offset:offset + length].decode()
+        offset += length
+
+    fixes = []
+    for _ in range(fix_count):
+        vin_id, dlat, dlon, dt, speed = FIX.unpack_from(frame, offset)
+        offset += FIX.size
+        plat, plon = last.get(vin_id, (0, 0))
+        lat, lon = plat + dlat, plon + dlon
+        last[vin_id] = (lat, lon)
+        fixes.append({
+            "device": vins[vin_id],
+            "lat": lat / COORD_SCALE,
+            "lon": lon / COORD_SCALE,
+            "timestamp": datetime.fromtimestamp(base_ts + dt).isoformat(),
+            "speed": speed / SPEED_SCALE
+        })
+    return fixes